@@ -0,0 +1,335 @@
+#! /usr/bin/python3
+
+import argparse, itertools, time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from compiled_dictionary import load_dictionary
+from score_checker import SCORES, WORDS_FILE, calculate_score, read_words
+
+# How to use:
+#
+# $ python3 anagram.py [--engine bucket|numpy|trie] [--workers N] input_file output_file
+#
+# For each line of |input_file|, write the highest-scoring dictionary word
+# that can be made from (a subset of) its letters to |output_file|.
+# With --workers N, the numpy engine splits the input into chunks and solves
+# them in N processes.
+
+NOT_FOUND = "not found"
+
+# Primes assigned to the letters. The product of the primes of a word
+# identifies its letter multiset, and word A can be made from the letters of
+# word B if and only if product(A) divides product(B).
+PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61,
+          67, 71, 73, 79, 83, 89, 97, 101]
+
+
+# Return the letter counts of |word| as a list of 26 integers.
+def count_letters(word):
+    letters = [0] * 26
+    for character in word:
+        letters[ord(character) - ord('a')] += 1
+    return letters
+
+
+# Return the product of the primes of the letters of |word|.
+def prime_product(word):
+    product = 1
+    for character in word:
+        product *= PRIMES[ord(character) - ord('a')]
+    return product
+
+
+# The dictionary compiled for sub-anagram queries, like counted_dictionary in
+# src/prob_2.cpp.
+#
+# |self.buckets|: self.buckets[score][length] is a list of
+#                 (prime product, word) of the words with the score and the
+#                 length.
+# |self.max_score|: The highest score of the dictionary words.
+# |self.max_length|: The length of the longest dictionary word.
+#
+# |dictionary|: The CompiledDictionary to build the buckets from.
+class CountedDictionary:
+    def __init__(self, dictionary):
+        self.max_score = max(dictionary.scores)
+        self.max_length = dictionary.max_length
+        self.buckets = [[[] for length in range(self.max_length + 1)]
+                        for score in range(self.max_score + 1)]
+        for word, score in zip(dictionary.words(), dictionary.scores):
+            self.buckets[score][len(word)].append((prime_product(word), word))
+
+    # Return the highest-scoring dictionary word that can be made from the
+    # letters of |word|, or NOT_FOUND.
+    #
+    # The buckets are visited from the highest score, so the first word that
+    # fits is the answer. Scores higher than the score of |word| itself and
+    # lengths longer than |word| can never fit and are skipped.
+    def find_anagram(self, word):
+        product = prime_product(word)
+        max_length = min(len(word), self.max_length)
+        for score in range(min(calculate_score(word), self.max_score), 0, -1):
+            lengths = self.buckets[score]
+            for length in range(1, max_length + 1):
+                for word_product, dictionary_word in lengths[length]:
+                    if product % word_product == 0:
+                        return dictionary_word
+        return NOT_FOUND
+
+
+# Encode |words| as a (len(words) x 26) uint8 matrix of letter counts.
+def count_matrix(words):
+    matrix = np.zeros((len(words), 26), dtype=np.uint8)
+    for i, word in enumerate(words):
+        matrix[i] = count_letters(word)
+    return matrix
+
+
+# The number of input lines matched at once.
+BATCH_SIZE = 1024
+# The number of dictionary words compared at once. The comparison of one
+# letter creates a (BATCH_SIZE x CHUNK_SIZE) boolean matrix.
+CHUNK_SIZE = 4096
+
+
+# Return the index of the highest-scoring dictionary word for each row of the
+# letter count matrix |inputs|, or -1 if no word fits.
+#
+# |counts|: The (26 x number of words) letter count matrix of the dictionary
+#           words sorted by score in descending order.
+#
+# fits[i][j] tells whether the dictionary word j can be made from the input
+# i. It is computed with one broadcasted comparison per letter. The words are
+# sorted by score, so the first True in each row is the answer. The
+# dictionary is compared chunk by chunk from the highest score, and the
+# inputs that already have an answer drop out.
+def find_indices(counts, inputs):
+    indices = np.full(len(inputs), -1)
+    pending = np.arange(len(inputs))
+    for begin in range(0, counts.shape[1], CHUNK_SIZE):
+        chunk = counts[:, begin:begin + CHUNK_SIZE]
+        rows = inputs[pending]
+        fits = chunk[0] <= rows[:, 0, np.newaxis]
+        for c in range(1, 26):
+            fits &= chunk[c] <= rows[:, c, np.newaxis]
+        found = fits.any(axis=1)
+        indices[pending[found]] = begin + fits[found].argmax(axis=1)
+        pending = pending[~found]
+        if len(pending) == 0:
+            break
+    return indices
+
+
+# The dictionary compiled for batched sub-anagram queries with NumPy.
+#
+# |self.dictionary|: The CompiledDictionary.
+# |self.order|: The word indices of |self.dictionary| sorted by score in
+#               descending order.
+# |self.counts|: The (26 x number of words) letter count matrix of the words
+#                in |self.order|. It is stored letter by letter so that the
+#                comparison of one letter reads contiguous memory.
+class CountMatrix:
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+        self.order = np.frombuffer(dictionary.score_order, dtype=np.uint32)
+        counts = np.frombuffer(dictionary.counts, dtype=np.uint8).reshape(-1, 26)
+        self.counts = np.ascontiguousarray(counts[self.order].T)
+
+    # Return the highest-scoring dictionary word for each of |words|.
+    def find_anagrams(self, words):
+        answers = []
+        for begin in range(0, len(words), BATCH_SIZE):
+            indices = find_indices(self.counts,
+                                   count_matrix(words[begin:begin + BATCH_SIZE]))
+            answers += self.to_words(indices)
+        return answers
+
+    # Convert the indices returned by find_indices() to the words.
+    def to_words(self, indices):
+        return [NOT_FOUND if index < 0 else
+                self.dictionary.word(self.order[index]) for index in indices]
+
+    def find_anagram(self, word):
+        return self.find_anagrams([word])[0]
+
+
+# The count matrix attached by each worker process of solve_file_parallel().
+worker_memory = None
+worker_counts = None
+
+
+def init_worker(name, shape):
+    global worker_memory, worker_counts
+    worker_memory = shared_memory.SharedMemory(name=name)
+    worker_counts = np.ndarray(shape, dtype=np.uint8, buffer=worker_memory.buf)
+
+
+def solve_chunk(words):
+    return find_indices(worker_counts, count_matrix(words))
+
+
+# Read |input_file| in chunks of |size| lines.
+def read_chunks(input_file, size):
+    with open(input_file) as f:
+        while True:
+            words = [line.rstrip('\n') for line in itertools.islice(f, size)]
+            if not words:
+                return
+            yield words
+
+
+# Solve |input_file| with |workers| processes.
+#
+# The count matrix is copied once to shared memory, and the workers attach to
+# it instead of receiving a pickled copy with every task. Only the input
+# words and the answer indices are sent between the processes, and the
+# answers are written in the input order.
+def solve_file_parallel(dictionary, input_file, output_file, workers):
+    memory = shared_memory.SharedMemory(create=True,
+                                        size=dictionary.counts.nbytes)
+    try:
+        counts = np.ndarray(dictionary.counts.shape, dtype=np.uint8,
+                            buffer=memory.buf)
+        counts[:] = dictionary.counts
+        with Pool(workers, init_worker,
+                  (memory.name, dictionary.counts.shape)) as pool, \
+                open(output_file, 'w') as f:
+            for indices in pool.imap(solve_chunk,
+                                     read_chunks(input_file, BATCH_SIZE)):
+                for answer in dictionary.to_words(indices):
+                    f.write(answer + '\n')
+        del counts
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+# A node of LetterTrie.
+#
+# |self.children|: A list of (letter index, child node) sorted by
+#                   |max_score| of the child, the highest first.
+# |self.word|: The word whose sorted letters end at this node, or None.
+# |self.max_score|: The highest score of the words in the subtree.
+class TrieNode:
+    __slots__ = ('children', 'word', 'max_score')
+
+    def __init__(self):
+        self.children = {}
+        self.word = None
+        self.max_score = 0
+
+
+# The letter-multiset trie of the dictionary. The path to a word is its
+# letters in alphabetical order, so all the anagrams of a word share one
+# node.
+#
+# The search walks the trie only with the letters of the input and keeps the
+# best word found so far. A subtree is skipped when its best word, or the
+# path score plus the remaining usable letters, can not beat it.
+class LetterTrie:
+    def __init__(self, dictionary):
+        self.root = TrieNode()
+        for word, score in zip(dictionary.words(), dictionary.scores):
+            node = self.root
+            for letter in sorted(ord(character) - ord('a')
+                                 for character in word):
+                if letter not in node.children:
+                    node.children[letter] = TrieNode()
+                node = node.children[letter]
+            if node.word is None:
+                node.word = word
+        self.freeze(self.root)
+
+    # Fill in |max_score| and sort the children of every node by it, the
+    # highest first, so that the search finds a good word early and can stop
+    # at the first child that can not beat it.
+    def freeze(self, node, score=0):
+        node.max_score = score if node.word is not None else 0
+        for letter, child in node.children.items():
+            self.freeze(child, score + SCORES[letter])
+            node.max_score = max(node.max_score, child.max_score)
+        node.children = sorted(node.children.items(),
+                               key=lambda item: -item[1].max_score)
+
+    def find_anagram(self, word):
+        counts = count_letters(word)
+        # suffix[letter] is the total score of the input letters from
+        # |letter| to 'z'.
+        self.suffix = [0] * 27
+        for letter in range(25, -1, -1):
+            self.suffix[letter] = (self.suffix[letter + 1] +
+                                   SCORES[letter] * counts[letter])
+        self.best_word = NOT_FOUND
+        self.best_score = 0
+        self.search(self.root, counts, 0, 0, self.suffix[0])
+        return self.best_word
+
+    # |counts|: The letter counts of the unused letters of the input.
+    # |score|: The score of the path to |node|.
+    # |last|: The last letter of the path. The path is in alphabetical order,
+    #         so only the letters from |last| can extend it.
+    # |usable|: The total score of the unused letters from |last|. The
+    #           letters after |last| are all unused, so the total from a
+    #           later letter is self.suffix[letter].
+    def search(self, node, counts, score, last, usable):
+        if node.word is not None and score > self.best_score:
+            self.best_word = node.word
+            self.best_score = score
+        for letter, child in node.children:
+            if child.max_score <= self.best_score:
+                return
+            if counts[letter] == 0:
+                continue
+            remaining = usable if letter == last else self.suffix[letter]
+            if score + remaining <= self.best_score:
+                continue
+            counts[letter] -= 1
+            self.search(child, counts, score + SCORES[letter], letter,
+                        remaining - SCORES[letter])
+            counts[letter] += 1
+
+
+ENGINES = {
+    'bucket': CountedDictionary,
+    'numpy': CountMatrix,
+    'trie': LetterTrie,
+}
+
+
+# Solve every line of |input_file| and write the answers to |output_file|.
+def solve_file(dictionary, input_file, output_file):
+    words = read_words(input_file)
+    if hasattr(dictionary, 'find_anagrams'):
+        answers = dictionary.find_anagrams(words)
+    else:
+        answers = [dictionary.find_anagram(word) for word in words]
+    with open(output_file, 'w') as f:
+        for answer in answers:
+            f.write(answer + '\n')
+
+
+def main(input_file, output_file, engine='bucket', workers=1):
+    begin = time.time()
+    dictionary = ENGINES[engine](load_dictionary(WORDS_FILE))
+    if workers > 1:
+        solve_file_parallel(dictionary, input_file, output_file, workers)
+    else:
+        solve_file(dictionary, input_file, output_file)
+    end = time.time()
+    print("%dms" % ((end - begin) * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', choices=ENGINES, default='bucket')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and args.engine != 'numpy':
+        parser.error("--workers requires --engine numpy")
+    main(args.input_file, args.output_file, args.engine, args.workers)
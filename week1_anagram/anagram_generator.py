@@ -1,28 +1,69 @@
-import sys, random
-
-def read_words(word_file, min_threshold, max_threshold):
-    words = []
-    with open(word_file) as f:
-        for line in f:
-            line = line.rstrip('\n')
-            if (min_threshold <= len(line) and len(line) <= max_threshold):
-                words.append(line)
-    return words
-
-def main(word_file, n, min_threshold, max_threshold):
-    words = read_words(word_file, min_threshold, max_threshold)
-    # print(len(words))
+import sys, random, mmap, string
+from array import array
+
+# How to use:
+#
+# $ python3 anagram_generator.py word_file n min_threshold max_threshold [output_file]
+#
+# Print |n| random strings of |max_threshold| characters. Each string is a
+# shuffled dictionary word of |min_threshold| to |max_threshold| characters
+# padded with random letters. The output is written to |output_file| if it is
+# given, or to the standard output.
+
+# The buffer size of the output.
+BUFFER_SIZE = 1 << 20
+
+
+# Build the offset table of the words whose length is in the band
+# [|min_threshold|, |max_threshold|].
+#
+# |words|: The mmap of the word file.
+# Return value: (offsets, lengths). The i-th word of the band is
+#               words[offsets[i]:offsets[i] + lengths[i]].
+def read_offsets(words, min_threshold, max_threshold):
+    offsets = array('q')
+    lengths = array('H')
+    offset = 0
+    while offset < len(words):
+        end = words.find(b'\n', offset)
+        if end == -1:
+            end = len(words)
+        if min_threshold <= end - offset and end - offset <= max_threshold:
+            offsets.append(offset)
+            lengths.append(end - offset)
+        offset = end + 1
+    return offsets, lengths
+
+
+# Generate |n| lines lazily. Only the offset table is kept in memory, so the
+# memory usage does not depend on |n|.
+def generate(words, offsets, lengths, n, max_threshold):
+    letters = string.ascii_lowercase
     for i in range(n):
-        word = words[int(random.random() * len(words))]
-        characters = list(word)
-        for j in range(max_threshold - len(characters)):
-            characters.append(chr(ord('a') + int(random.random() * 26)))
+        index = int(random.random() * len(offsets))
+        characters = list(words[offsets[index]:offsets[index] + lengths[index]]
+                          .decode())
+        characters += random.choices(letters, k=max_threshold - len(characters))
         assert(len(characters) == max_threshold)
         random.shuffle(characters)
-        print(''.join(characters))
+        yield ''.join(characters) + '\n'
+
+
+def main(word_file, n, min_threshold, max_threshold, output_file=None):
+    with open(word_file, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as words:
+        offsets, lengths = read_offsets(words, min_threshold, max_threshold)
+        if output_file is None:
+            out = open(sys.stdout.fileno(), 'w', buffering=BUFFER_SIZE,
+                       closefd=False)
+        else:
+            out = open(output_file, 'w', buffering=BUFFER_SIZE)
+        with out:
+            out.writelines(generate(words, offsets, lengths, n, max_threshold))
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("usage: %s word_file n min_threshold max_threshold" % sys.argv[0])
+    if len(sys.argv) not in (5, 6):
+        print("usage: %s word_file n min_threshold max_threshold [output_file]" % sys.argv[0])
         exit(1)
-    main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+    main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]),
+         sys.argv[5] if len(sys.argv) == 6 else None)
@@ -0,0 +1,114 @@
+#! /usr/bin/python3
+
+import argparse, json, os, subprocess, sys, tempfile, time
+
+from compiled_dictionary import load_dictionary
+from score_checker import WORDS_FILE, check_answers, read_words
+
+# How to use:
+#
+# $ python3 benchmark.py [--solver NAME ...] [--output results.json] [input_file ...]
+#
+# Run the registered solvers over the input files (small.txt, medium.txt and
+# large.txt by default). For each run, the wall time, the peak RSS, the
+# throughput and the score are printed and saved as JSON.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUT_FILES = ["small.txt", "medium.txt", "large.txt"]
+RESULTS_FILE = "benchmark.json"
+
+# The registered solvers. Each solver is a command that is run as
+# "<command> input_file output_file".
+SOLVERS = {
+    'bucket': [sys.executable, "anagram.py", "--engine", "bucket"],
+    'numpy': [sys.executable, "anagram.py", "--engine", "numpy"],
+    'numpy-workers': [sys.executable, "anagram.py", "--engine", "numpy",
+                      "--workers", str(os.cpu_count() or 1)],
+    'trie': [sys.executable, "anagram.py", "--engine", "trie"],
+    'prob_1': [os.path.join("src", "prob_1")],
+    'prob_2': [os.path.join("src", "prob_2")],
+}
+
+# The compiled solvers in src/ read the dictionary from "../anagram/words.txt"
+# relative to the current directory.
+COMPILED_SOLVERS = ['prob_1', 'prob_2']
+
+
+# Run |command| and wait for it.
+#
+# Return value: (exit status, wall time in seconds, peak RSS in KB)
+def run(command, cwd):
+    begin = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL)
+    (pid, status, usage) = os.wait4(process.pid, 0)
+    end = time.perf_counter()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KB on Linux and in bytes on macOS.
+    max_rss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return (process.returncode, end - begin, max_rss)
+
+
+# Run the solver |name| over |input_file| and score the answers.
+def benchmark(name, input_file, valid_words, work_dir):
+    input_file = os.path.abspath(input_file)
+    output_file = os.path.join(work_dir, "%s_%s" % (name, os.path.basename(input_file)))
+    command = [os.path.join(BASE_DIR, part) if part.startswith("src") else part
+               for part in SOLVERS[name]]
+    cwd = os.path.join(work_dir, "run") if name in COMPILED_SOLVERS else BASE_DIR
+    result = {'solver': name, 'input': os.path.basename(input_file)}
+    try:
+        (status, wall_time, max_rss) = run(command + [input_file, output_file], cwd)
+    except OSError as e:
+        result['error'] = str(e)
+        return result
+    data_words = read_words(input_file)
+    result['wall_time'] = wall_time
+    result['max_rss_kb'] = max_rss
+    result['lines_per_sec'] = len(data_words) / wall_time
+    if status != 0:
+        result['error'] = "exited with status %d" % status
+        return result
+    (score, error) = check_answers(data_words, read_words(output_file), valid_words)
+    result['score'] = score
+    if error is not None:
+        result['error'] = error
+    return result
+
+
+def main(solvers, input_files, results_file):
+    valid_words = set(load_dictionary(os.path.join(BASE_DIR, WORDS_FILE)).words())
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Lay out the dictionary where the compiled solvers look for it.
+        os.mkdir(os.path.join(work_dir, "run"))
+        os.mkdir(os.path.join(work_dir, "anagram"))
+        os.symlink(os.path.join(BASE_DIR, WORDS_FILE),
+                   os.path.join(work_dir, "anagram", WORDS_FILE))
+        for input_file in input_files:
+            for name in solvers:
+                result = benchmark(name, input_file, valid_words, work_dir)
+                results.append(result)
+                if 'wall_time' in result:
+                    print("%-14s %-12s %9.3fs %8dKB %10.1f lines/s  score %s%s" %
+                          (name, result['input'], result['wall_time'],
+                           result['max_rss_kb'], result['lines_per_sec'],
+                           result.get('score'),
+                           "  (%s)" % result['error'] if 'error' in result else ""))
+                else:
+                    print("%-14s %-12s failed: %s" %
+                          (name, result['input'], result['error']))
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results are saved to %s" % results_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--solver', action='append', choices=SOLVERS,
+                        help="the solver to run (default: all)")
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('input_files', nargs='*',
+                        default=[os.path.join(BASE_DIR, input_file)
+                                 for input_file in INPUT_FILES])
+    args = parser.parse_args()
+    main(args.solver or list(SOLVERS), args.input_files, args.output)
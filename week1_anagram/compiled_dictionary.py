@@ -0,0 +1,167 @@
+import mmap, os, struct, sys
+from array import array
+
+from score_checker import SCORES, WORDS_FILE, read_words
+
+# How to use:
+#
+# $ python3 compiled_dictionary.py [word_file]
+#
+# Compile |word_file| (words.txt by default) into a binary file next to it.
+# The tools load the binary file with mmap instead of re-reading the text.
+#
+# Layout of the binary file (all integers are little endian):
+#
+#   header          MAGIC, word count, max length, blob size
+#   length_offsets  uint32 x (max length + 2). The words of length L are the
+#                   words [length_offsets[L], length_offsets[L + 1]).
+#   word_offsets    uint32 x (word count + 1). Word i is
+#                   blob[word_offsets[i]:word_offsets[i + 1]].
+#   score_order     uint32 x word count. The word indices sorted by score in
+#                   descending order.
+#   scores          uint16 x word count
+#   counts          uint8 x (word count x 26). The letter counts of the words.
+#   blob            The words concatenated.
+#
+# The words are sorted by (length, word), so a word can be looked up with a
+# binary search in its length range.
+
+MAGIC = b'ANAGDIC1'
+HEADER = struct.Struct('<8sIII')
+BINARY_SUFFIX = ".bin"
+
+
+# Return the path of the binary file of |word_file|.
+def binary_path(word_file):
+    return word_file + BINARY_SUFFIX
+
+
+# Compile |word_file| into |binary_file|.
+def compile_dictionary(word_file, binary_file):
+    words = sorted(set(read_words(word_file)),
+                   key=lambda word: (len(word), word))
+    encoded = [word.encode() for word in words]
+    max_length = len(words[-1]) if words else 0
+
+    length_offsets = array('I', [0] * (max_length + 2))
+    for word in words:
+        length_offsets[len(word) + 1] += 1
+    for length in range(1, max_length + 2):
+        length_offsets[length] += length_offsets[length - 1]
+
+    word_offsets = array('I', [0])
+    for word in encoded:
+        word_offsets.append(word_offsets[-1] + len(word))
+
+    scores = array('H', [0] * len(words))
+    counts = array('B', [0] * (len(words) * 26))
+    for i, word in enumerate(words):
+        for character in word:
+            scores[i] += SCORES[ord(character) - ord('a')]
+            counts[i * 26 + ord(character) - ord('a')] += 1
+    # sorted() is stable, so the words of the same score stay in order.
+    score_order = array('I', sorted(range(len(words)),
+                                    key=lambda i: scores[i], reverse=True))
+
+    blob = b''.join(encoded)
+    # Write to a temporary file first so that a half-written file is never
+    # loaded by another run.
+    temp_file = binary_file + ".tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(words), max_length, len(blob)))
+        for section in (length_offsets, word_offsets, score_order, scores,
+                        counts):
+            if sys.byteorder == 'big':
+                section.byteswap()
+            f.write(section.tobytes())
+        f.write(blob)
+    os.replace(temp_file, binary_file)
+    return len(words)
+
+
+# The dictionary loaded from a binary file. The sections are memoryviews of
+# the mmap, so nothing is copied or parsed when it is loaded. NumPy users can
+# wrap them with numpy.frombuffer() without copying either.
+#
+# |self.length_offsets|, |self.word_offsets|, |self.score_order|,
+# |self.scores|: The sections of the binary file.
+# |self.counts|: The letter counts as a flat memoryview. The count of the
+#                letter c of the word i is self.counts[i * 26 + c].
+# |self.blob_offset|: The offset of the concatenated words in the file.
+class CompiledDictionary:
+    def __init__(self, binary_file):
+        with open(binary_file, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, word_count, max_length, blob_size = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError("%s is not a compiled dictionary" % binary_file)
+        assert sys.byteorder == 'little'
+        self.max_length = max_length
+        offset = HEADER.size
+        self.length_offsets, offset = self.view(offset, 'I', max_length + 2)
+        self.word_offsets, offset = self.view(offset, 'I', word_count + 1)
+        self.score_order, offset = self.view(offset, 'I', word_count)
+        self.scores, offset = self.view(offset, 'H', word_count)
+        self.counts, offset = self.view(offset, 'B', word_count * 26)
+        self.blob_offset = offset
+        self.blob_size = blob_size
+
+    # Return a memoryview of |count| items of |format| at |offset| and the
+    # offset of the next section.
+    def view(self, offset, format, count):
+        end = offset + struct.calcsize(format) * count
+        return memoryview(self.mmap)[offset:end].cast(format), end
+
+    def __len__(self):
+        return len(self.scores)
+
+    # Return the bytes of the word |index|.
+    def word_bytes(self, index):
+        return self.mmap[self.blob_offset + self.word_offsets[index]:
+                         self.blob_offset + self.word_offsets[index + 1]]
+
+    # Return the word |index| as a string.
+    def word(self, index):
+        return bytes(self.word_bytes(index)).decode()
+
+    # Return all the words as strings.
+    def words(self):
+        text = self.mmap[self.blob_offset:
+                         self.blob_offset + self.blob_size].decode()
+        offsets = self.word_offsets.tolist()
+        return [text[offsets[i]:offsets[i + 1]] for i in range(len(self))]
+
+    # Return True if |word| is in the dictionary. The word is searched with a
+    # binary search in the range of the words of the same length.
+    def contains(self, word):
+        if len(word) > self.max_length:
+            return False
+        key = word.encode()
+        begin = self.length_offsets[len(word)]
+        end = self.length_offsets[len(word) + 1]
+        while begin < end:
+            middle = (begin + end) // 2
+            if self.word_bytes(middle) < key:
+                begin = middle + 1
+            else:
+                end = middle
+        return begin < len(self) and self.word_bytes(begin) == key
+
+
+# Load the binary file of |word_file|. The binary file is compiled only when
+# it does not exist or is older than |word_file|.
+def load_dictionary(word_file=WORDS_FILE):
+    binary_file = binary_path(word_file)
+    if (not os.path.exists(binary_file) or
+            os.path.getmtime(binary_file) < os.path.getmtime(word_file)):
+        compile_dictionary(word_file, binary_file)
+    return CompiledDictionary(binary_file)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("usage: %s [word_file]" % sys.argv[0])
+        exit(1)
+    word_file = sys.argv[1] if len(sys.argv) == 2 else WORDS_FILE
+    count = compile_dictionary(word_file, binary_path(word_file))
+    print("%d words are compiled to %s" % (count, binary_path(word_file)))
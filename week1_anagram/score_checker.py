@@ -37,29 +37,47 @@ def is_anagram(anagram, data):
     for character in data:
         data_table[ord(character) - ord('a')] += 1
     for character in anagram:
+        if not ('a' <= character <= 'z'):
+            return False
         if (data_table[ord(character) - ord('a')] == 0):
             return False
         data_table[ord(character) - ord('a')] -= 1
     return True
 
+# Check the answers and calculate the total score.
+#
+# |valid_words|: The set of the valid words to check the answers against.
+# Return value: (score, None) if all the answers are correct. Otherwise,
+#               (None, the error message) is returned.
+def check_answers(data_words, answer_words, valid_words):
+    if len(data_words) != len(answer_words):
+        return (None, "The number of words doesn't match.")
+    score = 0
+    for i in range(len(data_words)):
+        if not is_anagram(answer_words[i], data_words[i]):
+            return (None, "'%s' is not an anagram of '%s'." %
+                    (answer_words[i], data_words[i]))
+        if answer_words[i] not in valid_words:
+            return (None, "'%s' is not a valid word!" % answer_words[i])
+        score += calculate_score(answer_words[i])
+    return (score, None)
+
 def main(data_file, answer_file):
-    valid_words = read_words(WORDS_FILE)
+    # compiled_dictionary imports this module, so import it here.
+    from compiled_dictionary import load_dictionary
+    # The compiled dictionary is memory-mapped instead of parsed. Its words
+    # are put in a set, so that each lookup is O(1) instead of a binary search.
+    valid_words = set(load_dictionary(WORDS_FILE).words())
     data_words = read_words(data_file)
     answer_words = read_words(answer_file)
     if len(data_words) != len(answer_words):
         print("The number of words in %s and %s doesn't match." %
               (data_file, answer_file))
         exit(1)
-    score = 0
-    for i in range(len(data_words)):
-        if not is_anagram(answer_words[i], data_words[i]):
-            print("'%s' is not an anagram of '%s'." %
-                  (answer_words[i], data_words[i]))
-            exit(1)
-        if answer_words[i] not in valid_words:
-            print("'%s' is not a valid word!" % answer_words[i])
-            exit(1)
-        score += calculate_score(answer_words[i])
+    score, error = check_answers(data_words, answer_words, valid_words)
+    if error is not None:
+        print(error)
+        exit(1)
     print('You answer is correct! Your score is %d.' % score)
 
 if __name__ == "__main__":
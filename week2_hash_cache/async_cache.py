@@ -0,0 +1,213 @@
+import asyncio, random, sys, time
+
+from cache import Cache
+from cache_policies import make_cache
+from hash_table import HashTable
+
+###########################################################################
+#                                                                         #
+# An asyncio read-through cache in front of a slow page fetcher.          #
+#                                                                         #
+# AsyncCache.get() returns the cached contents, or calls the loader on a  #
+# miss and caches the result. While a URL is being loaded, the other      #
+# get() calls for it wait for the same load instead of calling the        #
+# loader again (single-flight), and the number of the loads running at    #
+# once is bounded by a semaphore.                                         #
+#                                                                         #
+###########################################################################
+
+
+# The read-through cache.
+#
+# |cache|: The Cache, or any cache with the same get / access_page
+#          interface (see cache_policies.py). access_page() takes |count|,
+#          so that a miss is counted once, by get().
+# |loader|: An async function that takes a URL and returns its contents.
+# |max_concurrency|: The maximum number of the loads running at once.
+# |ttl|: The time to live given to access_page(). None to use the default
+#        of the cache. A cache without TTL support (see
+#        cache_policies.py) raises ValueError here, not on every load.
+# |coalesce|: False to call the loader for every miss. Only for the
+#             comparison in stampede_benchmark().
+#
+# |self.in_flight|: A HashTable from a URL to the task loading it.
+# |self.loads|: The number of the loader calls.
+# |self.coalesced|: The number of the misses that waited for a load started
+#                   by another get().
+class AsyncCache:
+    def __init__(self, cache, loader, max_concurrency=16, ttl=None,
+                 coalesce=True):
+        if ttl is not None and not cache.SUPPORTS_TTL:
+            raise ValueError("%s has no TTL" % type(cache).__name__)
+        self.cache = cache
+        self.loader = loader
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.ttl = ttl
+        self.coalesce = coalesce
+        self.in_flight = HashTable()
+        self.loads = 0
+        self.coalesced = 0
+
+    # Return the contents of |url|, loading them on a miss. An exception of
+    # the loader is raised to every caller waiting for the load, and nothing
+    # is cached.
+    async def get(self, url):
+        (contents, found) = self.cache.get(url)
+        if found:
+            return contents
+        if not self.coalesce:
+            return await self.load(url)
+        (task, found) = self.in_flight.get(url)
+        if found:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self.load(url))
+            self.in_flight.put(url, task)
+            task.add_done_callback(lambda task: self.finish(url, task))
+        # The load goes on for the other callers even if this one is
+        # cancelled.
+        return await asyncio.shield(task)
+
+    # Call the loader within the concurrency bound and cache the result.
+    async def load(self, url):
+        async with self.semaphore:
+            self.loads += 1
+            contents = await self.loader(url)
+        # get() has counted the miss. A None TTL is the default of the cache.
+        self.cache.access_page(url, contents, ttl=self.ttl, count=False)
+        return contents
+
+    def finish(self, url, task):
+        self.in_flight.delete(url)
+        # Mark the exception as retrieved, in case every caller has been
+        # cancelled; otherwise asyncio logs it.
+        if not task.cancelled():
+            task.exception()
+
+
+# An in-process page fetcher for the tests and the benchmark. It sleeps
+# |latency| seconds per page, as a slow backend would.
+#
+# |self.calls|: The number of the fetches.
+# |self.running|, |self.max_running|: The number of the fetches running now
+#                                     and its maximum.
+# |self.fail|: The URLs whose fetch raises an error.
+class FakeFetcher:
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.fail = set()
+
+    async def __call__(self, url):
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.latency)
+            if url in self.fail:
+                raise IOError("failed to fetch %s" % url)
+            return "contents of %s" % url
+        finally:
+            self.running -= 1
+
+
+def async_cache_test():
+    async def run():
+        fetcher = FakeFetcher()
+        cache = AsyncCache(Cache(100), fetcher, max_concurrency=4)
+
+        # 100 concurrent misses of one URL call the loader once.
+        results = await asyncio.gather(*[cache.get("a.com") for i in range(100)])
+        assert results == ["contents of a.com"] * 100
+        assert fetcher.calls == 1
+        assert cache.coalesced == 99
+        assert cache.in_flight.size() == 0
+
+        # A hit does not call the loader.
+        assert await cache.get("a.com") == "contents of a.com"
+        assert fetcher.calls == 1
+        # Each get() is counted once: 1 miss of the first caller, 99
+        # coalesced misses and 1 hit.
+        stats = cache.cache.stats()
+        assert (stats.hits, stats.misses) == (1, 100)
+        assert stats.byte_misses == len("contents of a.com")
+
+        # The concurrency is bounded.
+        urls = ["%d.com" % i for i in range(20)]
+        await asyncio.gather(*[cache.get(url) for url in urls])
+        assert fetcher.calls == 21
+        assert fetcher.max_running == 4
+
+        # An error is raised to every waiter, and is not cached.
+        fetcher.fail.add("bad.com")
+        results = await asyncio.gather(*[cache.get("bad.com") for i in range(5)],
+                                       return_exceptions=True)
+        assert all(isinstance(result, IOError) for result in results)
+        assert fetcher.calls == 22
+        fetcher.fail.discard("bad.com")
+        assert await cache.get("bad.com") == "contents of bad.com"
+        assert fetcher.calls == 23
+
+        # A cancelled caller does not cancel the load of the others.
+        first = asyncio.ensure_future(cache.get("slow.com"))
+        second = asyncio.ensure_future(cache.get("slow.com"))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "contents of slow.com"
+        assert fetcher.calls == 24
+
+        # The TTL is passed to the cache.
+        now = [0.0]
+        cache = AsyncCache(Cache(10, clock=lambda: now[0]), fetcher, ttl=10)
+        await cache.get("a.com")
+        now[0] = 10.0
+        await cache.get("a.com")
+        assert cache.loads == 2
+
+        # The caches of cache_policies.py work too, and a TTL they can not
+        # keep is rejected when the AsyncCache is created.
+        for policy in ('2q', 'arc', 'tinylfu'):
+            cache = AsyncCache(make_cache(policy, 10), fetcher)
+            assert await cache.get("a.com") == "contents of a.com"
+            assert await cache.get("a.com") == "contents of a.com"
+            assert cache.loads == 1
+            stats = cache.cache.stats()
+            assert (stats.hits, stats.misses) == (1, 1)
+            try:
+                AsyncCache(make_cache(policy, 10), fetcher, ttl=10)
+                assert False
+            except ValueError:
+                pass
+
+    asyncio.run(run())
+    print("Async cache tests passed!")
+
+
+# Send |requests| concurrent get() calls for Zipf-distributed URLs to an
+# empty cache, with and without single-flight, and print the loader calls
+# and the time.
+def stampede_benchmark(requests=10000, urls=100, latency=0.05):
+    random.seed(0)
+    weights = [1 / (i + 1) for i in range(urls)]
+    trace = ["%d.com" % i for i in random.choices(range(urls), weights, k=requests)]
+
+    async def run(coalesce):
+        fetcher = FakeFetcher(latency)
+        cache = AsyncCache(Cache(urls), fetcher, max_concurrency=64,
+                           coalesce=coalesce)
+        begin = time.time()
+        await asyncio.gather(*[cache.get(url) for url in trace])
+        end = time.time()
+        print("coalesce=%-5s loader calls %5d max running %3d %.2f s" %
+              (coalesce, fetcher.calls, fetcher.max_running, end - begin))
+
+    for coalesce in (False, True):
+        asyncio.run(run(coalesce))
+    print("Stampede benchmark passed!")
+
+
+if __name__ == "__main__":
+    async_cache_test()
+    stampede_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -1,4 +1,6 @@
-import sys
+import heapq, random, sys, time
+
+from hash_table import HashTable
 
 # Implement a data structure that stores the most recently accessed N pages.
 # See the below test cases to see how it should work.
@@ -6,37 +8,408 @@ import sys
 # Note: Please do not use a library like collections.OrderedDict). The goal is
 #       to implement the data structure yourself!
 
+# A page in the cache. A page is a node of the doubly linked list PageList
+# and the value of the hash table at the same time, so the hash table finds
+# the node of a URL in O(1).
+#
+# |url|: The URL of the page.
+# |contents|: The contents of the page.
+# |size|: The size of the contents in bytes.
+# |frequency|: The number of the accesses since the page was cached.
+# |priority|: The GDSF priority, or None if it is not in the heap.
+# |expires|: The time when the page expires, or None if it does not.
+# |timer|: The expiry time of the live entry of the page in the timer wheel,
+#          or None if it has no entry.
+# |prev|, |next|: The neighbors in PageList.
+class Page:
+    __slots__ = ('url', 'contents', 'size', 'frequency', 'priority',
+                 'expires', 'timer', 'prev', 'next')
+
+    def __init__(self, url, contents, size=0):
+        self.url = url
+        self.contents = contents
+        self.size = size
+        self.frequency = 0
+        self.priority = None
+        self.expires = None
+        self.timer = None
+        self.prev = None
+        self.next = None
+
+
+# Return the size of |contents| in bytes.
+def contents_size(contents):
+    if isinstance(contents, str):
+        return len(contents.encode())
+    if isinstance(contents, memoryview):
+        return contents.nbytes
+    if isinstance(contents, (bytes, bytearray)):
+        return len(contents)
+    return sys.getsizeof(contents)
+
+
+# A doubly linked list of pages, ordered from the most recently accessed to
+# the least recently accessed. |self.head| is a sentinel, so the first page
+# is head.next and the last page is head.prev. Every operation is O(1).
+class PageList:
+    def __init__(self):
+        self.head = Page(None, None)
+        self.head.prev = self.head
+        self.head.next = self.head
+
+    # Insert |page| at the front.
+    def push_front(self, page):
+        page.prev = self.head
+        page.next = self.head.next
+        self.head.next.prev = page
+        self.head.next = page
+
+    # Remove |page| from the list.
+    def remove(self, page):
+        page.prev.next = page.next
+        page.next.prev = page.prev
+        page.prev = None
+        page.next = None
+
+    # Move |page|, which is in the list, to the front.
+    def move_to_front(self, page):
+        if self.head.next is not page:
+            self.remove(page)
+            self.push_front(page)
+
+    # Remove the last page and return it. The list must not be empty.
+    def pop_back(self):
+        page = self.head.prev
+        self.remove(page)
+        return page
+
+    # Iterate the pages from the front.
+    def __iter__(self):
+        page = self.head.next
+        while page is not self.head:
+            yield page
+            page = page.next
+
+
+# A hashed timer wheel of the expiry times of the pages.
+#
+# The time is divided into ticks of |tick| seconds, and the tick t is kept in
+# the slot t % |size|. advance() visits only the slots of the ticks that have
+# passed since the last call, so the cost is the number of the entries due,
+# not the number of the pages. An entry more than one turn away stays in
+# its slot until its turn comes.
+#
+# An entry is (expiry time, page). The wheel does not know whether the page
+# is still cached with that expiry; the caller skips the stale entries.
+# A page has at most one live entry: when the page is accessed again with a
+# later expiry, the entry is kept and is moved when it comes due, so a hot
+# page does not add an entry per access.
+class TimerWheel:
+    def __init__(self, now, tick=1.0, size=512):
+        self.tick = tick
+        self.slots = [[] for i in range(size)]
+        # The first tick that has not been visited.
+        self.current = int(now // tick)
+
+    def add(self, expires, page):
+        # An entry in a visited tick goes to the current tick.
+        tick = max(int(expires // self.tick), self.current)
+        self.slots[tick % len(self.slots)].append((expires, page))
+
+    # Return the entries that have expired by |now|, from the ticks that
+    # have passed. The entries that are not due yet are put back.
+    def advance(self, now):
+        end = int(now // self.tick)
+        # One turn visits every slot.
+        end = min(end, self.current + len(self.slots))
+        due = []
+        later = []
+        for tick in range(self.current, end):
+            index = tick % len(self.slots)
+            slot = self.slots[index]
+            self.slots[index] = []
+            for entry in slot:
+                if entry[0] <= now:
+                    due.append(entry)
+                else:
+                    later.append(entry)
+        self.current = max(self.current, end)
+        for (expires, page) in later:
+            self.add(expires, page)
+        return due
+
+
+# The statistics of a cache, returned by Cache.stats().
+#
+# |self.hits|, |self.misses|: The number of the accesses that found / did not
+#                             find the page in the cache.
+# |self.byte_hits|, |self.byte_misses|: The bytes of the contents of those
+#                                       accesses. A miss of get() is counted
+#                                       in bytes only when the contents are
+#                                       put with access_page(count=False).
+# |self.page_count|: The number of the cached pages.
+# |self.total_bytes|: The total bytes of the cached contents.
+class CacheStats:
+    def __init__(self, hits, misses, byte_hits, byte_misses, page_count,
+                 total_bytes):
+        self.hits = hits
+        self.misses = misses
+        self.byte_hits = byte_hits
+        self.byte_misses = byte_misses
+        self.page_count = page_count
+        self.total_bytes = total_bytes
+
+    def hit_ratio(self):
+        accesses = self.hits + self.misses
+        return self.hits / accesses if accesses else 0.0
+
+    def byte_hit_ratio(self):
+        accessed_bytes = self.byte_hits + self.byte_misses
+        return self.byte_hits / accessed_bytes if accessed_bytes else 0.0
+
+    def __str__(self):
+        return ("pages %d bytes %d hits %d misses %d hit ratio %.3f "
+                "byte hit ratio %.3f" %
+                (self.page_count, self.total_bytes, self.hits, self.misses,
+                 self.hit_ratio(), self.byte_hit_ratio()))
+
+
 class Cache:
+    # Whether access_page() takes a TTL.
+    SUPPORTS_TTL = True
+
     # Initialize the cache.
-    # |n|: The size of the cache.
-    def __init__(self, n):
-        #------------------------#
-        # Write your code here!  #
-        #------------------------#
-        pass
+    # |n|: The size of the cache. None for no limit on the number of pages.
+    # |max_bytes|: The limit of the total bytes of the contents. None for no
+    #              limit.
+    # |policy|: Which page is evicted when the cache is over a limit.
+    #           'lru': The least recently accessed page.
+    #           'gdsf': The page with the lowest Greedy-Dual-Size-Frequency
+    #                   priority, L + frequency / size. A large page that is
+    #                   rarely accessed goes first. L is the priority of the
+    #                   last evicted page, so the old pages age.
+    # |default_ttl|: The time to live of a page in seconds, when
+    #                access_page() is not given one. None for no expiry.
+    # |clock|: The function that returns the current time in seconds.
+    #
+    # Expiry: an expired page is removed lazily when it is accessed, and
+    # every access also advances a TimerWheel that removes the expired pages
+    # that are not accessed. expire() does the same and can be called from a
+    # timer when the cache is idle.
+    #
+    # |self.pages|: A HashTable from a URL to its Page.
+    # |self.order|: The pages in the order of the access.
+    # |self.heap|: The heap of (priority, sequence number, page) for 'gdsf'.
+    #              An entry whose priority is not page.priority any more is
+    #              stale and skipped.
+    def __init__(self, n=None, max_bytes=None, policy='lru', default_ttl=None,
+                 clock=time.monotonic):
+        assert n is not None or max_bytes is not None
+        assert n is None or n > 0
+        if policy not in ('lru', 'gdsf'):
+            # The policies that count pages only are in cache_policies.py.
+            raise ValueError("Unknown policy: %s (see make_cache() in "
+                             "cache_policies.py)" % policy)
+        self.n = n
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.pages = HashTable()
+        self.order = PageList()
+        self.total_bytes = 0
+        self.heap = []
+        self.sequence = 0
+        self.inflation = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.byte_hits = 0
+        self.byte_misses = 0
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.wheel = TimerWheel(clock())
+        self.expired = 0
 
     # Access a page and update the cache so that it stores the most recently
     # accessed N pages. This needs to be done with mostly O(1).
+    # With |max_bytes|, pages are evicted until the contents fit in it. A page
+    # larger than |max_bytes| is not cached.
     # |url|: The accessed URL
     # |contents|: The contents of the URL
-    def access_page(self, url, contents):
-        #------------------------#
-        # Write your code here!  #
-        #------------------------#
-        pass
+    # |ttl|: The time to live of the contents in seconds. |default_ttl| if
+    #        None.
+    # |count|: False if the access has already been counted as a miss of
+    #          get(), as in a read-through cache. Only the bytes of the miss,
+    #          which get() did not know, are counted then.
+    def access_page(self, url, contents, ttl=None, count=True):
+        now = self.clock()
+        self.expire(now)
+        size = contents_size(contents)
+        (page, found) = self.pages.get(url)
+        if found and self.remove_if_expired(page, now):
+            found = False
+        if found:
+            if count:
+                self.hits += 1
+                self.byte_hits += page.size
+            self.total_bytes -= page.size
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.remove(page)
+                return
+            page.contents = contents
+            page.size = size
+            self.order.move_to_front(page)
+        else:
+            if count:
+                self.misses += 1
+            self.byte_misses += size
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            page = Page(url, contents, size)
+            self.pages.put(url, page)
+            self.order.push_front(page)
+        self.total_bytes += size
+        page.frequency += 1
+        if ttl is None:
+            ttl = self.default_ttl
+        page.expires = None if ttl is None else now + ttl
+        # The live entry is kept if it comes due no later than the new expiry.
+        if page.expires is not None and (page.timer is None or
+                                         page.timer > page.expires):
+            self.set_timer(page)
+        # The accessed page is kept out of the heap while others are evicted.
+        page.priority = None
+        self.evict()
+        self.update_priority(page)
+
+    # Get the contents of a cached page. A hit counts as an access, so the
+    # page becomes the most recently accessed one.
+    # |url|: The URL
+    # Return value: (the contents, True) if the page is cached. Otherwise,
+    #               (None, False).
+    def get(self, url):
+        now = self.clock()
+        self.expire(now)
+        (page, found) = self.pages.get(url)
+        if not found or self.remove_if_expired(page, now):
+            self.misses += 1
+            return (None, False)
+        self.hits += 1
+        self.byte_hits += page.size
+        page.frequency += 1
+        self.order.move_to_front(page)
+        self.update_priority(page)
+        return (page.contents, True)
+
+    # Remove the expired pages that the timer wheel has reached.
+    # |now|: The current time. The clock is read if None.
+    # Return value: The number of the removed pages.
+    def expire(self, now=None):
+        if now is None:
+            now = self.clock()
+        removed = 0
+        for (expires, page) in self.wheel.advance(now):
+            # The entry is stale if the page has been removed or given an
+            # earlier entry.
+            if page.timer != expires:
+                continue
+            page.timer = None
+            if self.remove_if_expired(page, now):
+                removed += 1
+            elif page.expires is not None:
+                # The page has been accessed again with a later expiry.
+                self.set_timer(page)
+        return removed
+
+    # Add the entry of the current expiry of |page| to the timer wheel. The
+    # previous entry of the page becomes stale.
+    def set_timer(self, page):
+        page.timer = page.expires
+        self.wheel.add(page.timer, page)
+
+    # Remove |page| if it has expired by |now|.
+    # Return value: True if the page is removed.
+    def remove_if_expired(self, page, now):
+        if page.expires is None or page.expires > now:
+            return False
+        self.total_bytes -= page.size
+        self.remove(page)
+        self.expired += 1
+        return True
+
+    # Return the statistics of the cache.
+    def stats(self):
+        return CacheStats(self.hits, self.misses, self.byte_hits,
+                          self.byte_misses, self.pages.size(),
+                          self.total_bytes)
+
+    # Return True if the cache is over |n| or |max_bytes|.
+    def over_limit(self):
+        return ((self.n is not None and self.pages.size() > self.n) or
+                (self.max_bytes is not None and
+                 self.total_bytes > self.max_bytes))
+
+    # Evict pages until the cache is within the limits.
+    def evict(self):
+        while self.over_limit():
+            if self.policy == 'lru':
+                page = self.order.head.prev
+            else:
+                page = self.pop_lowest_priority()
+                self.inflation = page.priority
+            self.total_bytes -= page.size
+            self.remove(page)
+
+    # Remove |page| from the cache. The bytes are not subtracted here. The
+    # contents are released now, although the heap or the timer wheel may
+    # still refer to the page.
+    def remove(self, page):
+        self.order.remove(page)
+        self.pages.delete(page.url)
+        page.priority = None
+        page.expires = None
+        page.timer = None
+        page.contents = None
+
+    # Set the GDSF priority of |page| and push it to the heap. The previous
+    # entry of the page becomes stale.
+    def update_priority(self, page):
+        if self.policy != 'gdsf':
+            return
+        page.priority = self.inflation + page.frequency / max(page.size, 1)
+        self.sequence += 1
+        heapq.heappush(self.heap, (page.priority, self.sequence, page))
+        # Drop the stale entries when they are the majority.
+        if len(self.heap) > 2 * self.pages.size() + 16:
+            self.heap = [entry for entry in self.heap
+                         if entry[2].priority == entry[0]]
+            heapq.heapify(self.heap)
+
+    # Pop the page with the lowest priority from the heap.
+    def pop_lowest_priority(self):
+        while True:
+            (priority, sequence, page) = heapq.heappop(self.heap)
+            if page.priority == priority:
+                return page
+
+    # Iterate the URLs stored in the cache lazily, from the most recently
+    # accessed one. The expired pages are skipped. Do not access the cache
+    # while iterating.
+    def iter_pages(self):
+        now = self.clock()
+        for page in self.order:
+            if page.expires is None or page.expires > now:
+                yield page.url
 
     # Return the URLs stored in the cache. The URLs are ordered in the order
     # in which the URLs are mostly recently accessed.
     def get_pages(self):
-        #------------------------#
-        # Write your code here!  #
-        #------------------------#
-        pass
+        return list(self.iter_pages())
 
 
-def cache_test():
+# |cache_class|: A function that takes the size and returns a cache with the
+#                interface of Cache.
+def cache_test(cache_class=Cache):
     # Set the size of the cache to 4.
-    cache = Cache(4)
+    cache = cache_class(4)
 
     # Initially, no page is cached.
     assert cache.get_pages() == []
@@ -109,8 +482,213 @@ def cache_test():
     #   (most recently accessed)<-- "a.com", "e.com", "f.com", "c.com" -->(least recently accessed)
     assert cache.get_pages() == ["a.com", "e.com", "f.com", "c.com"]
 
+    # get() is an access, too.
+    assert cache.get("c.com") == ("CCC", True)
+    assert cache.get_pages() == ["c.com", "a.com", "e.com", "f.com"]
+    assert cache.get("b.com") == (None, False)
+    assert cache.get_pages() == ["c.com", "a.com", "e.com", "f.com"]
+
+    # The contents are updated by a new access.
+    cache.access_page("f.com", "FFF2")
+    assert cache.get("f.com") == ("FFF2", True)
+
+    # A cache of size 1.
+    cache = cache_class(1)
+    cache.access_page("a.com", "AAA")
+    cache.access_page("b.com", "BBB")
+    assert cache.get_pages() == ["b.com"]
+    assert cache.get("a.com") == (None, False)
+
     print("Tests passed!")
 
 
+def byte_budget_test():
+    # LRU with a byte budget. The page count is not limited.
+    cache = Cache(max_bytes=10)
+    cache.access_page("a.com", "AAAA")
+    cache.access_page("b.com", "BBBB")
+    assert cache.get_pages() == ["b.com", "a.com"]
+    # 4 + 4 + 3 > 10, so "a.com" is evicted.
+    cache.access_page("c.com", "CCC")
+    assert cache.get_pages() == ["c.com", "b.com"]
+    assert cache.stats().total_bytes == 7
+    # A larger page evicts more than one page.
+    cache.access_page("d.com", "DDDDDDDDD")
+    assert cache.get_pages() == ["d.com"]
+    # A page larger than the budget is not cached.
+    cache.access_page("e.com", "E" * 11)
+    assert cache.get_pages() == ["d.com"]
+    # An update that grows a page evicts the others, not the page itself.
+    cache.access_page("f.com", "F")
+    cache.access_page("f.com", "FFF")
+    assert cache.get_pages() == ["f.com"]
+    assert cache.stats().total_bytes == 3
+
+    # The statistics.
+    stats = cache.stats()
+    assert (stats.hits, stats.misses) == (1, 6)
+    assert (stats.byte_hits, stats.byte_misses) == (1, 4 + 4 + 3 + 9 + 11 + 1)
+    assert cache.get("x.com") == (None, False)
+    assert cache.get("f.com") == ("FFF", True)
+    assert (cache.stats().hits, cache.stats().misses) == (2, 7)
+
+    # Both limits.
+    cache = Cache(2, max_bytes=100)
+    for url in ["a.com", "b.com", "c.com"]:
+        cache.access_page(url, "X")
+    assert cache.get_pages() == ["c.com", "b.com"]
+
+    # GDSF keeps the small page that is accessed often, and evicts the
+    # large page even though it was accessed more recently.
+    cache = Cache(max_bytes=100, policy='gdsf')
+    cache.access_page("small.com", "S" * 10)
+    cache.access_page("small.com", "S" * 10)
+    cache.access_page("large.com", "L" * 80)
+    cache.access_page("new.com", "N" * 20)
+    assert cache.get_pages() == ["new.com", "small.com"]
+    assert cache.stats().total_bytes == 30
+    for i in range(1000):
+        cache.access_page("%d.com" % i, "X" * (i % 50 + 1))
+        assert cache.stats().total_bytes <= 100
+    assert len(cache.heap) <= 2 * cache.pages.size() + 16
+
+    print("Byte budget tests passed!")
+
+
+def ttl_test():
+    # A fake clock, so that the test does not sleep.
+    now = [0.0]
+    clock = lambda: now[0]
+
+    cache = Cache(4, clock=clock)
+    cache.access_page("a.com", "AAA", ttl=10)
+    cache.access_page("b.com", "BBB")
+    now[0] = 9.9
+    assert cache.get("a.com") == ("AAA", True)
+    # Lazy expiry: "a.com" expires at 10 and get() finds it expired.
+    now[0] = 10.0
+    assert cache.get_pages() == ["b.com"]
+    assert cache.get("a.com") == (None, False)
+    assert cache.pages.size() == 1
+    # A new access_page() sets a new expiry, and an expired page is a miss.
+    cache.access_page("a.com", "AAA2", ttl=5)
+    now[0] = 14.0
+    cache.access_page("a.com", "AAA3", ttl=5)
+    now[0] = 16.0
+    assert cache.get("a.com") == ("AAA3", True)
+    now[0] = 19.0
+    assert cache.get("a.com") == (None, False)
+
+    # default_ttl and the byte budget.
+    cache = Cache(max_bytes=100, default_ttl=60, clock=clock)
+    cache.access_page("a.com", "A" * 50)
+    cache.access_page("b.com", "B" * 50, ttl=120)
+    now[0] += 61
+    assert cache.get_pages() == ["b.com"]
+    assert cache.expire() == 1
+    assert cache.stats().total_bytes == 50
+    assert cache.get("b.com") == ("B" * 50, True)
+
+    # The timer wheel removes the pages that are never accessed again. A
+    # sweep visits only the entries that are due.
+    now[0] = 1000.0
+    cache = Cache(10000, clock=clock)
+    for i in range(1000):
+        cache.access_page("%d.com" % i, i, ttl=i % 100 + 1)
+    # The long TTLs go around the wheel.
+    cache.access_page("long.com", "L", ttl=3600)
+    # A tick is swept after it has passed, so the pages that expire at 1050
+    # are removed at 1051.
+    now[0] = 1051.0
+    assert cache.expire() == 500
+    assert cache.pages.size() == 501
+    now[0] = 1101.0
+    assert cache.expire() == 500
+    assert cache.get_pages() == ["long.com"]
+    now[0] = 1000.0 + 3000
+    assert cache.expire() == 0
+    assert cache.get("long.com") == ("L", True)
+    now[0] = 1000.0 + 3600
+    assert cache.expire() == 1
+    assert cache.pages.size() == 0
+    assert cache.expired == 1001
+
+    # A page accessed again and again has one entry in the wheel, which is
+    # moved when it comes due.
+    now[0] = 0.0
+    cache = Cache(10, clock=clock)
+    for i in range(100000):
+        now[0] = i / 1000
+        cache.access_page("a.com", "A", ttl=10)
+    assert sum(len(slot) for slot in cache.wheel.slots) == 1
+    now[0] = 105.0
+    assert cache.expire() == 0
+    assert cache.get("a.com") == ("A", True)
+    # A shorter TTL adds an earlier entry.
+    cache.access_page("a.com", "A", ttl=1)
+    now[0] = 107.0
+    assert cache.expire() == 1
+    assert cache.pages.size() == 0
+
+    print("TTL tests passed!")
+
+
+# Compare the hit ratios of LRU and GDSF with a byte budget. The page sizes
+# are from 1 KB to 10 MB, and the small pages are more popular (Zipf-like).
+# The contents are slices of one buffer, so no memory is allocated for them.
+def byte_budget_benchmark(accesses=200000, max_bytes=100 * 1000 * 1000):
+    random.seed(0)
+    page_count = 10000
+    buffer = memoryview(bytes(10 * 1000 * 1000))
+    sizes = [int(1000 * 10 ** random.uniform(0, 4)) for i in range(page_count)]
+    # Sort so that the page i is smaller than the page i + 1.
+    sizes.sort()
+    weights = [1 / (i + 1) for i in range(page_count)]
+    trace = random.choices(range(page_count), weights, k=accesses)
+    for policy in ('lru', 'gdsf'):
+        cache = Cache(max_bytes=max_bytes, policy=policy)
+        begin = time.time()
+        for i in trace:
+            cache.access_page("%d.com" % i, buffer[:sizes[i]])
+        end = time.time()
+        print("%-4s %s %.2f us/access" %
+              (policy, cache.stats(), (end - begin) / accesses * 1e6))
+    print("Byte budget benchmark passed!")
+
+
+# Measure the time of access_page() for cache sizes from 4 to |max_n|. The
+# cache is filled first, and then |accesses| random URLs are accessed. Half
+# of them are cached (hits), and the others are new (misses that evict a
+# page). If access_page() is O(1), the time per access stays the same.
+def performance_test(max_n=1000000, accesses=100000):
+    random.seed(0)
+    for n in [4, 10, 100, 1000, 10000, 100000, 1000000]:
+        if n > max_n:
+            break
+        cache = Cache(n)
+        for i in range(n):
+            cache.access_page("%d.com" % i, i)
+        urls = []
+        next_url = n
+        for i in range(accesses):
+            if random.random() < 0.5:
+                # The pages from next_url - n to next_url - 1 are cached.
+                urls.append("%d.com" % random.randint(next_url - n, next_url - 1))
+            else:
+                urls.append("%d.com" % next_url)
+                next_url += 1
+        begin = time.time()
+        for url in urls:
+            cache.access_page(url, url)
+        end = time.time()
+        assert len(cache.get_pages()) == n
+        print("N=%7d %.2f us/access" % (n, (end - begin) / accesses * 1e6))
+    print("Performance tests passed!")
+
+
 if __name__ == "__main__":
     cache_test()
+    byte_budget_test()
+    ttl_test()
+    byte_budget_benchmark()
+    performance_test(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
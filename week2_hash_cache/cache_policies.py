@@ -0,0 +1,515 @@
+import random, sys, time
+from array import array
+
+from cache import Cache, CacheStats, Page, PageList
+from hash_functions import fnv1a_hash
+from hash_table import HashTable
+
+###########################################################################
+#                                                                         #
+# Scan-resistant eviction policies for the page cache.                    #
+#                                                                         #
+# A plain LRU cache forgets every hot page when a crawler reads many      #
+# pages only once. The policies here keep the pages that were accessed    #
+# more than once apart from the new pages:                                #
+#                                                                         #
+#   2Q        A new page enters a FIFO queue, and is promoted to the main #
+#             LRU only if it is accessed again after it leaves the queue. #
+#   ARC       Recency (T1) and frequency (T2) lists whose target sizes    #
+#             adapt to the hits on the ghost lists B1 and B2.             #
+#   W-TinyLFU A small LRU window, and a main SLRU that admits a page only #
+#             if a count-min sketch says it is more frequent than the     #
+#             page it would evict.                                        #
+#                                                                         #
+# They have the same access_page / get / get_pages / expire / stats      #
+# interface as Cache in cache.py, but count pages only: they have no      #
+# byte budget and no TTL. make_cache() creates any of them by name.       #
+#                                                                         #
+###########################################################################
+
+
+# A page that knows the list it is in.
+#
+# |list|: The PolicyList that has the page.
+class PolicyPage(Page):
+    __slots__ = ('list',)
+
+    def __init__(self, url, contents):
+        super().__init__(url, contents)
+        self.list = None
+
+
+# A PageList that counts its pages.
+#
+# |self.length|: The number of the pages in the list.
+# |self.ghost|: True if the pages of the list are not cached and only their
+#               URLs are remembered. The contents of a ghost page are None.
+class PolicyList(PageList):
+    def __init__(self, ghost=False):
+        super().__init__()
+        self.length = 0
+        self.ghost = ghost
+
+    def push_front(self, page):
+        super().push_front(page)
+        page.list = self
+        self.length += 1
+
+    def remove(self, page):
+        super().remove(page)
+        page.list = None
+        self.length -= 1
+
+    # Return the last page. The list must not be empty.
+    def back(self):
+        return self.head.prev
+
+
+# The base class of the policies. |self.pages| maps a URL to its page,
+# cached or ghost. A subclass implements hit(), miss() and
+# resident_lists().
+#
+# |n|: The size of the cache.
+# |max_bytes|, |default_ttl|: Only None. They are taken so that make_cache()
+#                             can pass the options of Cache, and a value is
+#                             rejected with ValueError instead of being
+#                             ignored.
+class PolicyCache:
+    # Whether access_page() takes a TTL.
+    SUPPORTS_TTL = False
+
+    def __init__(self, n, max_bytes=None, default_ttl=None):
+        assert n > 0
+        if max_bytes is not None:
+            raise ValueError("%s has no byte budget" % type(self).__name__)
+        if default_ttl is not None:
+            raise ValueError("%s has no TTL" % type(self).__name__)
+        self.n = n
+        self.pages = HashTable()
+        self.hits = 0
+        self.misses = 0
+
+    # Access a page. Same as Cache.access_page().
+    # |url|: The accessed URL
+    # |contents|: The contents of the URL
+    # |ttl|: Only None. A TTL is rejected with ValueError.
+    # |count|: False if the access has already been counted by get().
+    def access_page(self, url, contents, ttl=None, count=True):
+        if ttl is not None:
+            raise ValueError("%s has no TTL" % type(self).__name__)
+        (page, found) = self.pages.get(url)
+        if found and not page.list.ghost:
+            if count:
+                self.hits += 1
+            page.contents = contents
+            self.hit(page)
+        else:
+            if count:
+                self.misses += 1
+            self.miss(url, contents, page if found else None)
+
+    # Get the contents of a cached page. Same as Cache.get(). A miss does
+    # not change the cache because the contents are unknown.
+    def get(self, url):
+        (page, found) = self.pages.get(url)
+        if not found or page.list.ghost:
+            self.misses += 1
+            return (None, False)
+        self.hits += 1
+        self.hit(page)
+        return (page.contents, True)
+
+    # Iterate the URLs of the cached pages lazily. The pages of each
+    # resident list are ordered from the most recently accessed.
+    def iter_pages(self):
+        for page_list in self.resident_lists():
+            for page in page_list:
+                yield page.url
+
+    def get_pages(self):
+        return list(self.iter_pages())
+
+    def page_count(self):
+        return sum(page_list.length for page_list in self.resident_lists())
+
+    # Same as Cache.expire(). No page expires, so nothing is removed.
+    def expire(self, now=None):
+        return 0
+
+    # Return the statistics of the cache. The bytes are not counted.
+    def stats(self):
+        return CacheStats(self.hits, self.misses, 0, 0, self.page_count(), 0)
+
+    # Add a new page to the front of |page_list|.
+    def add(self, url, contents, page_list):
+        page = PolicyPage(url, contents)
+        self.pages.put(url, page)
+        page_list.push_front(page)
+        return page
+
+    # Move |page| to the front of |page_list|. A page moved to a ghost list
+    # drops its contents.
+    def move(self, page, page_list):
+        page.list.remove(page)
+        page_list.push_front(page)
+        if page_list.ghost:
+            page.contents = None
+
+    # Forget |page| completely.
+    def drop(self, page):
+        page.list.remove(page)
+        self.pages.delete(page.url)
+
+
+# 2Q ("2Q: A Low Overhead High Performance Buffer Management Replacement
+# Algorithm", Johnson and Shasha, 1994).
+#
+# |self.a1in|: The FIFO queue of the new pages. Up to n / 4 pages.
+# |self.a1out|: The ghost FIFO of the pages evicted from a1in. Up to n / 2
+#               URLs.
+# |self.am|: The LRU of the pages accessed again after they left a1in.
+class TwoQueueCache(PolicyCache):
+    def __init__(self, n, **options):
+        super().__init__(n, **options)
+        self.a1in = PolicyList()
+        self.a1out = PolicyList(ghost=True)
+        self.am = PolicyList()
+        self.kin = max(1, n // 4)
+        self.kout = max(1, n // 2)
+
+    def resident_lists(self):
+        return (self.am, self.a1in)
+
+    def hit(self, page):
+        # A hit in a1in does not move the page, so that a burst of accesses
+        # to a new page does not make it hot.
+        if page.list is self.am:
+            self.am.move_to_front(page)
+
+    def miss(self, url, contents, ghost):
+        # Take the ghost out first, or reclaim() may forget it.
+        if ghost is not None:
+            self.a1out.remove(ghost)
+        self.reclaim()
+        if ghost is not None:
+            self.am.push_front(ghost)
+            ghost.contents = contents
+        else:
+            self.add(url, contents, self.a1in)
+
+    # Make room for one page.
+    def reclaim(self):
+        if self.a1in.length + self.am.length < self.n:
+            return
+        if self.a1in.length > self.kin or self.am.length == 0:
+            self.move(self.a1in.back(), self.a1out)
+            if self.a1out.length > self.kout:
+                self.drop(self.a1out.back())
+        else:
+            self.drop(self.am.back())
+
+
+# ARC ("ARC: A Self-Tuning, Low Overhead Replacement Cache", Megiddo and
+# Modha, 2003).
+#
+# |self.t1|: The pages accessed once recently.
+# |self.t2|: The pages accessed at least twice recently.
+# |self.b1|, |self.b2|: The ghosts of the pages evicted from t1 and t2.
+# |self.p|: The target size of t1. A hit in b1 means t1 was too small, so p
+#           grows. A hit in b2 shrinks it.
+class ARCCache(PolicyCache):
+    def __init__(self, n, **options):
+        super().__init__(n, **options)
+        self.t1 = PolicyList()
+        self.t2 = PolicyList()
+        self.b1 = PolicyList(ghost=True)
+        self.b2 = PolicyList(ghost=True)
+        self.p = 0.0
+
+    def resident_lists(self):
+        return (self.t1, self.t2)
+
+    def hit(self, page):
+        if page.list is self.t2:
+            self.t2.move_to_front(page)
+        else:
+            self.move(page, self.t2)
+
+    def miss(self, url, contents, ghost):
+        if ghost is not None and ghost.list is self.b1:
+            self.p = min(self.n, self.p + max(self.b2.length / self.b1.length, 1))
+            self.replace(False)
+            self.move(ghost, self.t2)
+            ghost.contents = contents
+            return
+        if ghost is not None:
+            self.p = max(0.0, self.p - max(self.b1.length / self.b2.length, 1))
+            self.replace(True)
+            self.move(ghost, self.t2)
+            ghost.contents = contents
+            return
+        l1 = self.t1.length + self.b1.length
+        total = l1 + self.t2.length + self.b2.length
+        if l1 == self.n:
+            if self.t1.length < self.n:
+                self.drop(self.b1.back())
+                self.replace(False)
+            else:
+                self.drop(self.t1.back())
+        elif total >= self.n:
+            if total == 2 * self.n:
+                self.drop(self.b2.back())
+            self.replace(False)
+        self.add(url, contents, self.t1)
+
+    # Evict a page from t1 to b1 or from t2 to b2, if the cache is full.
+    # |in_b2|: True if the accessed page was found in b2.
+    def replace(self, in_b2):
+        if self.t1.length + self.t2.length < self.n:
+            return
+        if self.t1.length > 0 and (
+                self.t1.length > self.p or
+                (in_b2 and self.t1.length == self.p) or self.t2.length == 0):
+            self.move(self.t1.back(), self.b1)
+        else:
+            self.move(self.t2.back(), self.b2)
+
+
+# A count-min sketch of the access frequencies with 4-bit counters.
+#
+# |width|: The number of the counters in a row. Rounded up to a power of 2.
+# |depth|: The number of the rows. An estimate is the minimum of the rows.
+# |sample_size|: After this many increments, all the counters are halved,
+#                so old accesses fade out.
+class CountMinSketch:
+    MAX_COUNT = 15
+
+    def __init__(self, width, depth=4, sample_size=None):
+        self.width = 1
+        while self.width < width:
+            self.width <<= 1
+        self.depth = depth
+        self.counters = array('B', bytes(self.width * depth))
+        self.sample_size = 10 * width if sample_size is None else sample_size
+        self.additions = 0
+
+    # Return the index of |key| in each row. The rows use the double hashing
+    # h1 + i * h2 of one 64-bit hash, so the key is hashed only once.
+    def indices(self, key):
+        hash = fnv1a_hash(key)
+        h1 = hash & 0xffffffff
+        h2 = (hash >> 32) | 1
+        mask = self.width - 1
+        return [row * self.width + ((h1 + row * h2) & mask)
+                for row in range(self.depth)]
+
+    def increment(self, key):
+        counters = self.counters
+        for index in self.indices(key):
+            if counters[index] < self.MAX_COUNT:
+                counters[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.counters = array('B', [count >> 1 for count in counters])
+            self.additions >>= 1
+
+    def estimate(self, key):
+        counters = self.counters
+        return min(counters[index] for index in self.indices(key))
+
+
+# W-TinyLFU ("TinyLFU: A Highly Efficient Cache Admission Policy", Einziger,
+# Friedman and Manes, 2017).
+#
+# |self.window|: The LRU of the new pages. 1% of the cache.
+# |self.probation|, |self.protected|: The main SLRU. A page enters the
+#                                      probation, and moves to the protected
+#                                      (80% of the main) when it is hit.
+# |self.sketch|: The frequencies of all the accessed URLs.
+class TinyLFUCache(PolicyCache):
+    def __init__(self, n, **options):
+        super().__init__(n, **options)
+        self.window = PolicyList()
+        self.probation = PolicyList()
+        self.protected = PolicyList()
+        self.window_size = max(1, n // 100)
+        self.main_size = n - self.window_size
+        self.protected_size = int(self.main_size * 0.8)
+        self.sketch = CountMinSketch(n)
+
+    def resident_lists(self):
+        return (self.window, self.protected, self.probation)
+
+    def access_page(self, url, contents, ttl=None, count=True):
+        # An access counted by get() has been counted in the sketch too.
+        if count:
+            self.sketch.increment(url)
+        super().access_page(url, contents, ttl, count)
+
+    def get(self, url):
+        self.sketch.increment(url)
+        return super().get(url)
+
+    def hit(self, page):
+        if page.list is self.probation:
+            self.move(page, self.protected)
+            if self.protected.length > self.protected_size:
+                self.move(self.protected.back(), self.probation)
+        else:
+            page.list.move_to_front(page)
+
+    def miss(self, url, contents, ghost):
+        self.add(url, contents, self.window)
+        if self.window.length <= self.window_size:
+            return
+        candidate = self.window.back()
+        if self.probation.length + self.protected.length < self.main_size:
+            self.move(candidate, self.probation)
+            return
+        victim = (self.probation.back() if self.probation.length > 0
+                  else self.protected.back())
+        if (self.sketch.estimate(candidate.url) >
+                self.sketch.estimate(victim.url)):
+            self.drop(victim)
+            self.move(candidate, self.probation)
+        else:
+            self.drop(candidate)
+
+
+POLICIES = {
+    'lru': Cache,
+    '2q': TwoQueueCache,
+    'arc': ARCCache,
+    'tinylfu': TinyLFUCache,
+}
+
+
+# Create a cache of size |n| with the eviction policy |policy|, one of
+# POLICIES. |options| are the other arguments of Cache, like max_bytes and
+# default_ttl. The policies other than 'lru' raise ValueError for them.
+def make_cache(policy, n, **options):
+    return POLICIES[policy](n, **options)
+
+
+def policy_test():
+    for policy in POLICIES:
+        cache = make_cache(policy, 4)
+        assert cache.get_pages() == []
+        cache.access_page("a.com", "AAA")
+        assert cache.get_pages() == ["a.com"]
+        assert cache.get("a.com") == ("AAA", True)
+        assert cache.get("b.com") == (None, False)
+        cache.access_page("a.com", "AAA2")
+        assert cache.get("a.com") == ("AAA2", True)
+
+        # The cache never holds more than n pages, and get() agrees with
+        # get_pages().
+        random.seed(0)
+        for i in range(5000):
+            url = "%d.com" % int(random.expovariate(0.1))
+            cache.access_page(url, url)
+            pages = cache.get_pages()
+            assert len(pages) <= 4
+            assert len(set(pages)) == len(pages)
+            assert cache.get(url) == ((url, True) if url in pages else
+                                      (None, False))
+        # The ghosts are bounded too.
+        assert cache.pages.size() <= 2 * 4 + 1
+
+        # A scan of pages accessed only once does not flush the hot pages
+        # out of the scan-resistant policies.
+        n = 100
+        cache = make_cache(policy, n)
+        hot = ["hot%d.com" % i for i in range(n // 2)]
+        # The hot pages are accessed among pages accessed only once, so they
+        # are re-accessed after leaving the queue of 2Q.
+        for i in range(20):
+            for url in hot:
+                cache.access_page(url, url)
+            for j in range(n // 2):
+                cache.access_page("cold%d-%d.com" % (i, j), "")
+        for i in range(10 * n):
+            cache.access_page("scan%d.com" % i, "")
+        survived = sum(cache.get(url)[1] for url in hot)
+        if policy == 'lru':
+            assert survived == 0
+        else:
+            assert survived >= len(hot) * 0.9, (policy, survived)
+
+        # Every policy takes the arguments of Cache. The ones it does not
+        # support are rejected, not ignored.
+        cache = make_cache(policy, 4)
+        cache.access_page("a.com", "AAA", count=False)
+        assert (cache.stats().hits, cache.stats().misses) == (0, 0)
+        assert cache.get("a.com") == ("AAA", True)
+        assert cache.expire() == 0
+        for options in ({'max_bytes': 100}, {'default_ttl': 10}):
+            if cache.SUPPORTS_TTL:
+                make_cache(policy, 4, **options)
+                continue
+            try:
+                make_cache(policy, 4, **options)
+                assert False
+            except ValueError:
+                pass
+        if cache.SUPPORTS_TTL:
+            cache.access_page("b.com", "BBB", ttl=10)
+        else:
+            try:
+                cache.access_page("b.com", "BBB", ttl=10)
+                assert False
+            except ValueError:
+                pass
+    try:
+        Cache(4, policy='arc')
+        assert False
+    except ValueError:
+        pass
+    print("Policy tests passed!")
+
+
+# Return a trace of |length| URLs from a Zipf distribution over |keys| URLs.
+def zipf_trace(length, keys, alpha=0.9):
+    weights = [1 / (i + 1) ** alpha for i in range(keys)]
+    return ["%d.com" % i for i in random.choices(range(keys), weights, k=length)]
+
+
+# Replay synthetic traces with every policy and print the hit ratios and the
+# time per access.
+#
+# zipf: Zipf accesses over 100 * n URLs.
+# scan: The same, but every 10 * n accesses a crawler reads 2 * n new URLs
+#       once each.
+# loop: A loop over 1.5 * n URLs, the worst case of LRU.
+def replay_benchmark(n=1000, length=200000):
+    random.seed(0)
+    zipf = zipf_trace(length, 100 * n)
+    scan = []
+    scan_count = 0
+    for i in range(len(zipf)):
+        scan.append(zipf[i])
+        if i % (10 * n) == 10 * n - 1:
+            for j in range(2 * n):
+                scan.append("scan%d.com" % scan_count)
+                scan_count += 1
+    loop = ["%d.com" % (i % (n * 3 // 2)) for i in range(length)]
+    traces = {'zipf': zipf, 'scan': scan, 'loop': loop}
+
+    print("%-8s" % "" + "".join("%18s" % policy for policy in POLICIES))
+    for name, trace in traces.items():
+        row = "%-8s" % name
+        for policy in POLICIES:
+            cache = make_cache(policy, n)
+            begin = time.time()
+            for url in trace:
+                cache.access_page(url, url)
+            end = time.time()
+            row += "%9.3f %5.2fus" % (cache.stats().hit_ratio(),
+                                      (end - begin) / len(trace) * 1e6)
+        print(row)
+    print("Replay benchmark passed!")
+
+
+if __name__ == "__main__":
+    policy_test()
+    replay_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
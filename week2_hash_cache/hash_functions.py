@@ -0,0 +1,186 @@
+import random, sys
+
+###########################################################################
+#                                                                         #
+# Hash functions for the hash tables.                                     #
+#                                                                         #
+# Every hash function takes a string key and returns a non-negative       #
+# integer. make_hash_function() returns one of them bound to a seed, and  #
+# the result can be passed to HashTable(hash_function=...).               #
+#                                                                         #
+###########################################################################
+
+MASK64 = (1 << 64) - 1
+
+
+# The polynomial hash of calculate_hash() in hash_table.py.
+#
+# The multiplier is 131, the smallest prime larger than the number of the
+# ASCII characters. The seed is used as the initial value.
+def polynomial_hash(key, seed=0):
+    hash = seed
+    mod = 998244353
+    for i in key:
+        hash = (hash * 131 + ord(i)) % mod
+    return hash
+
+
+# 64-bit FNV-1a. The seed is mixed into the offset basis.
+def fnv1a_hash(key, seed=0):
+    hash = 0xcbf29ce484222325 ^ seed
+    for byte in key.encode():
+        hash ^= byte
+        hash = (hash * 0x100000001b3) & MASK64
+    return hash
+
+
+def rotate_left(x, bits):
+    return ((x << bits) | (x >> (64 - bits))) & MASK64
+
+
+def sip_round(v0, v1, v2, v3):
+    v0 = (v0 + v1) & MASK64
+    v1 = rotate_left(v1, 13) ^ v0
+    v0 = rotate_left(v0, 32)
+    v2 = (v2 + v3) & MASK64
+    v3 = rotate_left(v3, 16) ^ v2
+    v0 = (v0 + v3) & MASK64
+    v3 = rotate_left(v3, 21) ^ v0
+    v2 = (v2 + v1) & MASK64
+    v1 = rotate_left(v1, 17) ^ v2
+    v2 = rotate_left(v2, 32)
+    return v0, v1, v2, v3
+
+
+# SipHash-2-4 keyed by the 128-bit key (|seed| low 64 bits, |seed| high 64
+# bits). Without the key, an attacker can not choose keys that collide.
+def siphash(key, seed=0):
+    k0 = seed & MASK64
+    k1 = (seed >> 64) & MASK64
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+    data = key.encode()
+    end = len(data) - len(data) % 8
+    for i in range(0, end, 8):
+        m = int.from_bytes(data[i:i + 8], 'little')
+        v3 ^= m
+        v0, v1, v2, v3 = sip_round(v0, v1, v2, v3)
+        v0, v1, v2, v3 = sip_round(v0, v1, v2, v3)
+        v0 ^= m
+    m = ((len(data) & 0xff) << 56) | int.from_bytes(data[end:], 'little')
+    v3 ^= m
+    v0, v1, v2, v3 = sip_round(v0, v1, v2, v3)
+    v0, v1, v2, v3 = sip_round(v0, v1, v2, v3)
+    v0 ^= m
+    v2 ^= 0xff
+    for i in range(4):
+        v0, v1, v2, v3 = sip_round(v0, v1, v2, v3)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+PRIME64_1 = 0x9E3779B185EBCA87
+PRIME64_2 = 0xC2B2AE3D27D4EB4F
+PRIME64_3 = 0x165667B19E3779F9
+PRIME64_4 = 0x85EBCA77C2B2AE63
+PRIME64_5 = 0x27D4EB2F165667C5
+
+
+def xxh64_round(acc, lane):
+    acc = (acc + lane * PRIME64_2) & MASK64
+    return (rotate_left(acc, 31) * PRIME64_1) & MASK64
+
+
+def xxh64_merge_round(acc, value):
+    acc ^= xxh64_round(0, value)
+    return (acc * PRIME64_1 + PRIME64_4) & MASK64
+
+
+# XXH64. Every input bit is mixed into the whole result by the final
+# avalanche, so the low bits are as good as the high bits.
+def xxhash(key, seed=0):
+    data = key.encode()
+    length = len(data)
+    index = 0
+    if length >= 32:
+        v1 = (seed + PRIME64_1 + PRIME64_2) & MASK64
+        v2 = (seed + PRIME64_2) & MASK64
+        v3 = seed & MASK64
+        v4 = (seed - PRIME64_1) & MASK64
+        while index + 32 <= length:
+            v1 = xxh64_round(v1, int.from_bytes(data[index:index + 8], 'little'))
+            v2 = xxh64_round(v2, int.from_bytes(data[index + 8:index + 16], 'little'))
+            v3 = xxh64_round(v3, int.from_bytes(data[index + 16:index + 24], 'little'))
+            v4 = xxh64_round(v4, int.from_bytes(data[index + 24:index + 32], 'little'))
+            index += 32
+        hash = (rotate_left(v1, 1) + rotate_left(v2, 7) +
+                rotate_left(v3, 12) + rotate_left(v4, 18)) & MASK64
+        for v in (v1, v2, v3, v4):
+            hash = xxh64_merge_round(hash, v)
+    else:
+        hash = (seed + PRIME64_5) & MASK64
+    hash = (hash + length) & MASK64
+    while index + 8 <= length:
+        hash ^= xxh64_round(0, int.from_bytes(data[index:index + 8], 'little'))
+        hash = (rotate_left(hash, 27) * PRIME64_1 + PRIME64_4) & MASK64
+        index += 8
+    if index + 4 <= length:
+        hash ^= (int.from_bytes(data[index:index + 4], 'little') * PRIME64_1) & MASK64
+        hash = (rotate_left(hash, 23) * PRIME64_2 + PRIME64_3) & MASK64
+        index += 4
+    while index < length:
+        hash ^= (data[index] * PRIME64_5) & MASK64
+        hash = (rotate_left(hash, 11) * PRIME64_1) & MASK64
+        index += 1
+    hash ^= hash >> 33
+    hash = (hash * PRIME64_2) & MASK64
+    hash ^= hash >> 29
+    hash = (hash * PRIME64_3) & MASK64
+    hash ^= hash >> 32
+    return hash
+
+
+HASH_FUNCTIONS = {
+    'polynomial': polynomial_hash,
+    'fnv1a': fnv1a_hash,
+    'siphash': siphash,
+    'xxhash': xxhash,
+}
+
+
+# Return the hash function |name| bound to |seed|.
+#
+# |name|: One of HASH_FUNCTIONS.
+# Return value: A function that takes a key and returns its hash value.
+def make_hash_function(name, seed=0):
+    hash_function = HASH_FUNCTIONS[name]
+    return lambda key: hash_function(key, seed)
+
+
+# Compare the hash functions on some key distributions. For each of them,
+# print the statistics of a HashTable that holds the keys.
+def compare_hash_functions(key_count=100000):
+    from hash_table import HashTable
+
+    random.seed(0)
+    distributions = {
+        # The keys of performance_test().
+        'random numbers': [str(random.randint(0, 100000000))
+                           for i in range(key_count)],
+        'sequential numbers': [str(i) for i in range(key_count)],
+        # Anagrams of each other.
+        'anagrams': [''.join(random.sample('abcdefghijkl', 12))
+                     for i in range(key_count)],
+    }
+    for distribution, keys in distributions.items():
+        print("==== %s ====" % distribution)
+        for name in HASH_FUNCTIONS:
+            hash_table = HashTable(hash_function=make_hash_function(name, 12345))
+            for key in keys:
+                hash_table.put(key, key)
+            print("%-10s %s" % (name, hash_table.stats()))
+
+
+if __name__ == "__main__":
+    compare_hash_functions(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
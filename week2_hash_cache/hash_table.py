@@ -1,4 +1,4 @@
-import random, sys, time
+import gc, random, sys, time
 
 ###########################################################################
 #                                                                         #
@@ -19,8 +19,7 @@ def calculate_hash(key):
     hash = 0
     mod = 998244353
     for i in key:
-        hash *= 131
-        hash += ord(i)
+        hash = (hash * 131 + ord(i)) % mod
     return hash
 
 
@@ -30,6 +29,9 @@ class Item:
     # |value|: The value of the item.
     # |next|: The next item in the linked list. If this is the last item in the
     #         linked list, |next| is None.
+    # __slots__ saves the per-instance __dict__.
+    __slots__ = ('key', 'value', 'next')
+
     def __init__(self, key, value, next):
         assert type(key) == str
         self.key = key
@@ -37,6 +39,32 @@ class Item:
         self.next = next
 
 
+# The statistics of a hash table, returned by HashTable.stats().
+#
+# |self.item_count|: The total number of items.
+# |self.bucket_size|: The bucket size.
+# |self.load_factor|: item_count / bucket_size.
+# |self.histogram|: self.histogram[n] is the number of the buckets whose
+#                   chain has n items. For open addressing, it is the number
+#                   of the items found after n probes instead.
+# |self.max_length|: The length of the longest chain (or probe sequence).
+class HashTableStats:
+    def __init__(self, item_count, bucket_size, histogram):
+        self.item_count = item_count
+        self.bucket_size = bucket_size
+        self.load_factor = item_count / bucket_size
+        self.histogram = histogram
+        self.max_length = 0
+        for length in range(len(histogram)):
+            if histogram[length] > 0:
+                self.max_length = length
+
+    def __str__(self):
+        return ("items %d buckets %d load %.3f max %d histogram %s" %
+                (self.item_count, self.bucket_size, self.load_factor,
+                 self.max_length, self.histogram))
+
+
 # The main data structure of the hash table that stores key - value pairs.
 # The key must be a string. The value can be any type.
 #
@@ -44,16 +72,32 @@ class Item:
 # |self.buckets|: An array of the buckets. self.buckets[hash % self.bucket_size]
 #                 stores a linked list of items whose hash value is |hash|.
 # |self.item_count|: The total number of items in the hash table.
+# |self.hash_function|: The hash function. calculate_hash() by default. See
+#                       hash_functions.py for the others.
+#
+# Incremental rehashing:
+# If |incremental| is True, rehashing does not move all the items at once.
+# The previous buckets are kept in |self.old_buckets|, and every put / get /
+# delete moves the next MIGRATE_STEP buckets of them to |self.buckets|. While
+# the migration is in progress, the old buckets from |self.migrate_index|
+# have not been moved yet and are searched too.
 class HashTable:
+    # The number of the old buckets moved per operation.
+    MIGRATE_STEP = 8
 
     # Initialize the hash table.
-    def __init__(self, bucket_size=None):
+    def __init__(self, bucket_size=None, incremental=False, hash_function=None):
         # Set the initial bucket size to 97. A prime number is chosen to reduce
         # hash conflicts.
         self.bucket_size = 97 if bucket_size==None else bucket_size
         self.buckets = [None] * self.bucket_size
         self.item_count = 0
         self.rehashed = False
+        self.hash_function = calculate_hash if hash_function is None else hash_function
+        self.incremental = incremental
+        self.old_buckets = None
+        self.old_bucket_size = 0
+        self.migrate_index = 0
 
     # Put an item to the hash table. If the key already exists, the
     # corresponding value is updated to a new value.
@@ -65,7 +109,14 @@ class HashTable:
     def put(self, key, value):
         assert type(key) == str
         self.check_size() # Note: Don't remove this code.
-        bucket_index = calculate_hash(key) % self.bucket_size
+        hash = self.hash_function(key)
+        if self.old_buckets is not None:
+            self.migrate(self.MIGRATE_STEP)
+            item = self.find_old(key, hash)
+            if item:
+                item.value = value
+                return False
+        bucket_index = hash % self.bucket_size
         item = self.buckets[bucket_index]
         while item:
             if item.key == key:
@@ -88,7 +139,13 @@ class HashTable:
     def get(self, key):
         assert type(key) == str
         self.check_size() # Note: Don't remove this code.
-        bucket_index = calculate_hash(key) % self.bucket_size
+        hash = self.hash_function(key)
+        if self.old_buckets is not None:
+            self.migrate(self.MIGRATE_STEP)
+            item = self.find_old(key, hash)
+            if item:
+                return (item.value, True)
+        bucket_index = hash % self.bucket_size
         item = self.buckets[bucket_index]
         while item:
             if item.key == key:
@@ -101,33 +158,203 @@ class HashTable:
     # |key|: The key.
     # Return value: True if the item is found and deleted successfully. False
     #               otherwise.
-    def delete(self, key, bucket_index=None):
+    def delete(self, key):
         assert type(key) == str
-        if bucket_index == None:
-            bucket_index = calculate_hash(key) % self.bucket_size
-        item = self.buckets[bucket_index]
-        
+        hash = self.hash_function(key)
+        deleted = False
+        if self.old_buckets is not None:
+            self.migrate(self.MIGRATE_STEP)
+            if self.old_buckets is not None:
+                old_index = hash % self.old_bucket_size
+                if old_index >= self.migrate_index:
+                    deleted = self.unlink(self.old_buckets, old_index, key)
+        if not deleted:
+            deleted = self.unlink(self.buckets, hash % self.bucket_size, key)
+        if not deleted:
+            return False
+        self.item_count -= 1
+        if self.judge_rehash_shrink():
+            self.rehash_shrink()
+        return True
+
+    # Put many items at once.
+    #
+    # The keys are hashed first, and the hash table is resized at most once
+    # before the items are added, for the size after the batch. The items
+    # are then linked in one loop with the buckets in local variables.
+    #
+    # |items|: A list of (key, value).
+    # Return value: A list of the return values of put() for the items.
+    def put_many(self, items):
+        self.check_size() # Note: Don't remove this code.
+        hash_function = self.hash_function
+        for key, value in items:
+            assert type(key) == str
+        hashes = [hash_function(key) for key, value in items]
+        bucket_size = self.fitting_bucket_size(self.item_count + len(items))
+        if bucket_size != self.bucket_size:
+            self.resize(bucket_size)
+        else:
+            self.migrate(self.MIGRATE_STEP * len(items))
+        buckets = self.buckets
+        bucket_size = self.bucket_size
+        migrating = self.old_buckets is not None
+        results = [True] * len(items)
+        added = 0
+        for i, (key, value) in enumerate(items):
+            hash = hashes[i]
+            item = self.find_old(key, hash) if migrating else None
+            bucket_index = hash % bucket_size
+            head = buckets[bucket_index]
+            if not item:
+                item = head
+                while item and item.key != key:
+                    item = item.next
+            if item:
+                item.value = value
+                results[i] = False
+                continue
+            buckets[bucket_index] = Item(key, value, head)
+            added += 1
+        self.item_count += added
+        # Some keys may have existed already.
+        bucket_size = self.fitting_bucket_size(self.item_count)
+        if bucket_size != self.bucket_size:
+            self.resize(bucket_size)
+        return results
+
+    # Get many items at once.
+    #
+    # |keys|: A list of the keys.
+    # Return value: A list of the return values of get() for the keys.
+    def get_many(self, keys):
+        self.check_size() # Note: Don't remove this code.
+        hash_function = self.hash_function
+        hashes = []
+        for key in keys:
+            assert type(key) == str
+            hashes.append(hash_function(key))
+        self.migrate(self.MIGRATE_STEP * len(keys))
+        results = []
+        for i in range(len(keys)):
+            item = self.find_item(keys[i], hashes[i])
+            results.append((item.value, True) if item else (None, False))
+        return results
+
+    # Delete many items at once. The hash table is resized at most once after
+    # the items are deleted.
+    #
+    # |keys|: A list of the keys.
+    # Return value: A list of the return values of delete() for the keys.
+    def delete_many(self, keys):
+        hash_function = self.hash_function
+        hashes = []
+        for key in keys:
+            assert type(key) == str
+            hashes.append(hash_function(key))
+        self.migrate(self.MIGRATE_STEP * len(keys))
+        results = []
+        for i in range(len(keys)):
+            deleted = False
+            if self.old_buckets is not None:
+                old_index = hashes[i] % self.old_bucket_size
+                if old_index >= self.migrate_index:
+                    deleted = self.unlink(self.old_buckets, old_index, keys[i])
+            if not deleted:
+                deleted = self.unlink(self.buckets, hashes[i] % self.bucket_size,
+                                      keys[i])
+            if deleted:
+                self.item_count -= 1
+            results.append(deleted)
+        bucket_size = self.fitting_bucket_size(self.item_count)
+        if bucket_size != self.bucket_size:
+            self.resize(bucket_size)
+        return results
+
+    # Return the bucket size that repeated rehash_expand() / rehash_shrink()
+    # would reach for |item_count| items.
+    def fitting_bucket_size(self, item_count):
+        bucket_size = self.bucket_size
+        while item_count > bucket_size * 0.7:
+            bucket_size = bucket_size * 2 + 1
+        if self.rehashed or bucket_size != self.bucket_size:
+            while item_count < bucket_size * 0.3 and bucket_size > 100:
+                bucket_size >>= 1
+        return bucket_size
+
+    # Rehash to |bucket_size| buckets at once, even in the incremental mode.
+    def resize(self, bucket_size):
+        if bucket_size > self.bucket_size:
+            self.rehashed = True
+        self.rehash(bucket_size)
+        self.migrate(self.old_bucket_size)
+
+    # Return the item of |key|, or None.
+    def find_item(self, key, hash):
+        item = self.find_old(key, hash)
+        if item:
+            return item
+        item = self.buckets[hash % self.bucket_size]
+        while item:
+            if item.key == key:
+                return item
+            item = item.next
+        return None
+
+    # Remove the item of |key| from the linked list of buckets[bucket_index].
+    # Return value: True if the item is found.
+    def unlink(self, buckets, bucket_index, key):
+        item = buckets[bucket_index]
         prev = None
         while item:
             if item.key == key:
                 if prev == None:
-                    self.buckets[bucket_index] = item.next
+                    buckets[bucket_index] = item.next
                 else:
                     prev.next = item.next
-                self.item_count -= 1
-                if self.judge_rehash_shrink():
-                    self.rehash_shrink()
-                # if self.item_count < self.bucket_size * 0.3:
-                #     self.rehash_shrink()
                 return True
             prev = item
             item = item.next
         return False
 
+    # Return the item of |key| in the old buckets that have not been moved
+    # yet, or None.
+    def find_old(self, key, hash):
+        if self.old_buckets is None:
+            return None
+        old_index = hash % self.old_bucket_size
+        if old_index < self.migrate_index:
+            return None
+        item = self.old_buckets[old_index]
+        while item:
+            if item.key == key:
+                return item
+            item = item.next
+        return None
+
     # Return the total number of items in the hash table.
     def size(self):
         return self.item_count
 
+    # Return the statistics of the chains. The old buckets that have not been
+    # moved yet are counted too.
+    def stats(self):
+        histogram = []
+        chains = [(self.buckets, 0)]
+        if self.old_buckets is not None:
+            chains.append((self.old_buckets, self.migrate_index))
+        for buckets, begin in chains:
+            for bucket_index in range(begin, len(buckets)):
+                length = 0
+                item = buckets[bucket_index]
+                while item:
+                    length += 1
+                    item = item.next
+                while len(histogram) <= length:
+                    histogram.append(0)
+                histogram[length] += 1
+        return HashTableStats(self.item_count, self.bucket_size, histogram)
+
     # Check that the hash table has a "reasonable" bucket size.
     # The bucket size is judged "reasonable" if it is smaller than 100 or
     # the buckets are 30% or more used.
@@ -162,43 +389,56 @@ class HashTable:
     # Rehash the hash table if the buckets exceeds 70%.
     # Extend the bucket size by 2 times.
     def rehash_expand(self):
-        prev_bucket_size = self.bucket_size
-        prev_item_count = self.item_count
-        self.bucket_size = prev_bucket_size * 2 + 1
-        self.buckets += [None] * (prev_bucket_size + 1)
-        for bucket_index in range(prev_bucket_size):
-            item = self.buckets[bucket_index]
-            while item:
-                temp_key, temp_value = item.key, item.value
-                temp_index = calculate_hash(temp_key) % prev_bucket_size
-                item = item.next
-                self.delete(temp_key, temp_index)
-                self.put(temp_key, temp_value)
-        assert (self.item_count == prev_item_count)
+        self.rehash(self.bucket_size * 2 + 1)
         self.rehashed = True
         return
 
     # Rehash the hash table if the buckets becomes lower than 30%.
     # Reduce the size by half.
     def rehash_shrink(self):
-        prev_bucket_size = self.bucket_size
-        prev_item_count = self.item_count
-        self.bucket_size >>= 1
-        for bucket_index in range(prev_bucket_size):
-            item = self.buckets[bucket_index]
-            while item:
-                temp_key, temp_value = item.key, item.value
-                temp_index = calculate_hash(temp_key) % prev_bucket_size
-                item = item.next
-                self.delete(temp_key, temp_index)
-                self.put(temp_key, temp_value)
-        assert (self.item_count == prev_item_count)
+        self.rehash(self.bucket_size >> 1)
         return
 
+    # Replace the buckets with |bucket_size| new buckets. The items are
+    # relinked to the new buckets, not copied.
+    def rehash(self, bucket_size):
+        # Finish the previous migration first.
+        self.migrate(self.old_bucket_size)
+        self.old_buckets = self.buckets
+        self.old_bucket_size = self.bucket_size
+        self.migrate_index = 0
+        self.bucket_size = bucket_size
+        self.buckets = [None] * bucket_size
+        if not self.incremental:
+            self.migrate(self.old_bucket_size)
+
+    # Move up to |count| old buckets to the new buckets.
+    def migrate(self, count):
+        if self.old_buckets is None:
+            return
+        end = min(self.migrate_index + count, self.old_bucket_size)
+        for bucket_index in range(self.migrate_index, end):
+            item = self.old_buckets[bucket_index]
+            while item:
+                next_item = item.next
+                new_index = self.hash_function(item.key) % self.bucket_size
+                item.next = self.buckets[new_index]
+                self.buckets[new_index] = item
+                item = next_item
+            self.old_buckets[bucket_index] = None
+        self.migrate_index = end
+        if self.migrate_index == self.old_bucket_size:
+            self.old_buckets = None
+            self.old_bucket_size = 0
+            self.migrate_index = 0
+
 
 # Test the functional behavior of the hash table.
-def functional_test():
-    hash_table = HashTable()
+#
+# |hash_table_class|: The hash table class to test. Any class with the same
+#                     put / get / delete / size interface can be tested.
+def functional_test(hash_table_class=HashTable):
+    hash_table = hash_table_class()
 
     assert hash_table.put("aaa", 1) == True
     assert hash_table.get("aaa") == (1, True)
@@ -262,6 +502,48 @@ def functional_test():
     print("Functional tests passed!")
 
 
+# Test the batch operations against the single-item operations.
+def batch_test(hash_table_class=HashTable):
+    hash_table = hash_table_class()
+    assert hash_table.put_many([("aaa", 1), ("bbb", 2), ("aaa", 3)]) == [True, True, False]
+    assert hash_table.get_many(["aaa", "bbb", "ccc"]) == [(3, True), (2, True), (None, False)]
+    assert hash_table.size() == 2
+    assert hash_table.delete_many(["aaa", "ccc"]) == [True, False]
+    assert hash_table.size() == 1
+
+    keys = [str(i) for i in range(100000)]
+    assert hash_table.put_many([(key, key) for key in keys]) == [True] * len(keys)
+    hash_table.check_size()
+    assert hash_table.size() == 100001
+    assert hash_table.get_many(keys[::7]) == [(key, True) for key in keys[::7]]
+    assert hash_table.delete_many(keys[:99000]) == [True] * 99000
+    hash_table.check_size()
+    assert hash_table.get("99999") == ("99999", True)
+    assert hash_table.get("0") == (None, False)
+    assert hash_table.delete_many(keys) == [False] * 99000 + [True] * 1000
+    assert hash_table.delete("bbb") == True
+    assert hash_table.size() == 0
+
+    # Compare the time of the batch operations with the loops.
+    random.seed(0)
+    items = [(str(random.randint(0, 100000000)),) * 2 for i in range(200000)]
+    hash_table = hash_table_class()
+    begin = time.time()
+    for key, value in items:
+        hash_table.put(key, value)
+    loop_time = time.time() - begin
+    hash_table = hash_table_class()
+    begin = time.time()
+    hash_table.put_many(items)
+    batch_time = time.time() - begin
+    print("put: loop %.6f batch %.6f (%.1fx)" %
+          (loop_time, batch_time, loop_time / batch_time))
+    # Both hash every key, which takes about half of the batch time, so the
+    # batch is not much more than 2x faster.
+    assert batch_time < loop_time
+    print("Batch tests passed!")
+
+
 # Test the performance of the hash table.
 #
 # Your goal is to make the hash table work with mostly O(1).
@@ -270,8 +552,8 @@ def functional_test():
 # goal, you will need to 1) implement rehashing (Hint: expand / shrink the hash
 # table when the number of items in the hash table hits some threshold) and
 # 2) tweak the hash function (Hint: think about ways to reduce hash conflicts).
-def performance_test():
-    hash_table = HashTable()
+def performance_test(hash_table_class=HashTable):
+    hash_table = hash_table_class()
 
     for iteration in range(100):
         begin = time.time()
@@ -299,6 +581,61 @@ def performance_test():
     print("Performance tests passed!")
 
 
+# Return the |percentile|-th percentile of |latencies|.
+def percentile(latencies, percentile):
+    latencies = sorted(latencies)
+    return latencies[min(len(latencies) - 1,
+                         int(len(latencies) * percentile / 100))]
+
+
+# Test the latency of each operation while the hash table grows and shrinks.
+#
+# performance_test() measures the total time of each iteration, which hides
+# the stalls of rehashing. This test prints the 99th percentile and the
+# maximum latency of put / get in each iteration and of delete in each
+# iteration of the shrinking phase. With incremental rehashing, they should
+# stay flat while the hash table is resized.
+#
+# The garbage collector is disabled during the test. Its full collections
+# walk all the items and stall for as long as a full rehash does, which would
+# hide the difference.
+def latency_test(hash_table_class=HashTable):
+    gc.disable()
+    hash_table = hash_table_class()
+
+    for iteration in range(50):
+        latencies = []
+        random.seed(iteration)
+        for i in range(10000):
+            key = str(random.randint(0, 100000000))
+            begin = time.perf_counter()
+            hash_table.put(key, key)
+            hash_table.get(key)
+            latencies.append(time.perf_counter() - begin)
+        print("put/get %d p99 %.6f max %.6f" %
+              (iteration, percentile(latencies, 99), max(latencies)))
+
+    for iteration in range(50):
+        latencies = []
+        random.seed(iteration)
+        for i in range(10000):
+            key = str(random.randint(0, 100000000))
+            begin = time.perf_counter()
+            hash_table.delete(key)
+            latencies.append(time.perf_counter() - begin)
+        print("delete %d p99 %.6f max %.6f" %
+              (iteration, percentile(latencies, 99), max(latencies)))
+
+    assert hash_table.size() == 0
+    gc.enable()
+    print("Latency tests passed!")
+
+
 if __name__ == "__main__":
     functional_test()
+    functional_test(lambda: HashTable(incremental=True))
+    batch_test()
+    batch_test(lambda: HashTable(incremental=True))
     performance_test()
+    latency_test()
+    latency_test(lambda: HashTable(incremental=True))
@@ -0,0 +1,213 @@
+import random, sys, tracemalloc
+from array import array
+
+from hash_table import (HashTable, calculate_hash, functional_test,
+                        performance_test)
+from hash_table_open import OpenAddressingHashTable
+
+###########################################################################
+#                                                                         #
+# A memory-compact hash table.                                            #
+#                                                                         #
+# HashTable in hash_table.py allocates an Item object for every key.      #
+# This variant keeps the entries in a struct of arrays: the hashes and    #
+# the links are machine integers in array.array, and the keys and values  #
+# are plain lists. A link is an entry index instead of an object pointer. #
+#                                                                         #
+###########################################################################
+
+# The link that means "no entry".
+NONE = -1
+
+
+# The memory-compact hash table. It has the same put / get / delete / size
+# interface as HashTable in hash_table.py.
+#
+# |self.bucket_size|: The bucket size.
+# |self.heads|: self.heads[bucket_index] is the first entry of the bucket.
+# |self.hashes|: self.hashes[i] is the hash value of the entry i.
+# |self.next|: self.next[i] is the next entry of the entry i in its bucket,
+#              or in the free list if the entry i is deleted.
+# |self.keys|, |self.values|: The key and the value of the entry i. The key
+#                             of a deleted entry is None.
+# |self.free|: The first deleted entry that can be reused.
+# |self.item_count|: The total number of items in the hash table.
+class CompactHashTable:
+
+    # Initialize the hash table.
+    def __init__(self, bucket_size=None, hash_function=None):
+        # Set the initial bucket size to 97. A prime number is chosen to reduce
+        # hash conflicts.
+        self.bucket_size = 97 if bucket_size==None else bucket_size
+        self.heads = array('q', [NONE]) * self.bucket_size
+        self.hashes = array('Q')
+        self.next = array('q')
+        self.keys = []
+        self.values = []
+        self.free = NONE
+        self.item_count = 0
+        self.rehashed = False
+        self.hash_function = calculate_hash if hash_function is None else hash_function
+
+    # Return the entry of |key|, or NONE.
+    def find(self, key, hash):
+        entry = self.heads[hash % self.bucket_size]
+        while entry != NONE:
+            if self.hashes[entry] == hash and self.keys[entry] == key:
+                return entry
+            entry = self.next[entry]
+        return NONE
+
+    # Put an item to the hash table. If the key already exists, the
+    # corresponding value is updated to a new value.
+    #
+    # |key|: The key of the item.
+    # |value|: The value of the item.
+    # Return value: True if a new item is added. False if the key already exists
+    #               and the value is updated.
+    def put(self, key, value):
+        assert type(key) == str
+        self.check_size() # Note: Don't remove this code.
+        hash = self.hash_function(key)
+        entry = self.find(key, hash)
+        if entry != NONE:
+            self.values[entry] = value
+            return False
+        bucket_index = hash % self.bucket_size
+        if self.free != NONE:
+            entry = self.free
+            self.free = self.next[entry]
+            self.hashes[entry] = hash
+            self.next[entry] = self.heads[bucket_index]
+            self.keys[entry] = key
+            self.values[entry] = value
+        else:
+            entry = len(self.keys)
+            self.hashes.append(hash)
+            self.next.append(self.heads[bucket_index])
+            self.keys.append(key)
+            self.values.append(value)
+        self.heads[bucket_index] = entry
+        self.item_count += 1
+
+        if self.item_count > self.bucket_size * 0.7:
+            self.rehash(self.bucket_size * 2 + 1)
+            self.rehashed = True
+        return True
+
+    # Get an item from the hash table.
+    #
+    # |key|: The key.
+    # Return value: If the item is found, (the value of the item, True) is
+    #               returned. Otherwise, (None, False) is returned.
+    def get(self, key):
+        assert type(key) == str
+        self.check_size() # Note: Don't remove this code.
+        entry = self.find(key, self.hash_function(key))
+        if entry == NONE:
+            return (None, False)
+        return (self.values[entry], True)
+
+    # Delete an item from the hash table. The entry is added to the free list.
+    #
+    # |key|: The key.
+    # Return value: True if the item is found and deleted successfully. False
+    #               otherwise.
+    def delete(self, key):
+        assert type(key) == str
+        hash = self.hash_function(key)
+        bucket_index = hash % self.bucket_size
+        entry = self.heads[bucket_index]
+        prev = NONE
+        while entry != NONE:
+            if self.hashes[entry] == hash and self.keys[entry] == key:
+                break
+            prev = entry
+            entry = self.next[entry]
+        if entry == NONE:
+            return False
+        if prev == NONE:
+            self.heads[bucket_index] = self.next[entry]
+        else:
+            self.next[prev] = self.next[entry]
+        self.next[entry] = self.free
+        self.free = entry
+        self.keys[entry] = None
+        self.values[entry] = None
+        self.item_count -= 1
+        if (self.item_count < self.bucket_size * 0.3 and self.rehashed and
+                self.bucket_size > 100):
+            self.rehash(self.bucket_size >> 1)
+        return True
+
+    # Return the total number of items in the hash table.
+    def size(self):
+        return self.item_count
+
+    # Check that the hash table has a "reasonable" bucket size.
+    # The bucket size is judged "reasonable" if it is smaller than 100 or
+    # the buckets are 30% or more used.
+    def check_size(self):
+        assert (self.bucket_size < 100 or
+                self.item_count >= self.bucket_size * 0.3)
+
+    # Rebuild the buckets with |bucket_size| buckets. The stored hash values
+    # are reused. The live entries are packed to the front, so the arrays
+    # shrink together with the buckets.
+    def rehash(self, bucket_size):
+        hashes, keys, values = self.hashes, self.keys, self.values
+        self.bucket_size = bucket_size
+        self.heads = array('q', [NONE]) * bucket_size
+        self.hashes = array('Q')
+        self.next = array('q')
+        self.keys = []
+        self.values = []
+        self.free = NONE
+        for i in range(len(keys)):
+            if keys[i] is None:
+                continue
+            bucket_index = hashes[i] % bucket_size
+            self.next.append(self.heads[bucket_index])
+            self.heads[bucket_index] = len(self.keys)
+            self.hashes.append(hashes[i])
+            self.keys.append(keys[i])
+            self.values.append(values[i])
+
+    # Return the memory used by the hash table itself in bytes, as
+    # (buckets and links, key and value lists). The keys and the values are
+    # not included because they are shared with the caller.
+    def memory_usage(self):
+        return (sys.getsizeof(self.heads) + sys.getsizeof(self.hashes) +
+                sys.getsizeof(self.next),
+                sys.getsizeof(self.keys) + sys.getsizeof(self.values))
+
+
+# Compare the memory used by the hash tables to store |n| keys. The keys are
+# created before the measurement, so only the hash table itself is counted.
+# Tracing the allocations is slow, so |n| is kept small by default.
+def memory_test(n=200000):
+    random.seed(0)
+    keys = [str(random.randint(0, 100000000)) for i in range(n)]
+    for hash_table_class in (HashTable, OpenAddressingHashTable,
+                             CompactHashTable):
+        tracemalloc.start()
+        hash_table = hash_table_class()
+        for key in keys:
+            hash_table.put(key, key)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("%-24s %d keys %7.1f MB %6.1f bytes/key" %
+              (hash_table_class.__name__, hash_table.size(), memory / 1e6,
+               memory / hash_table.size()))
+        if hash_table_class == CompactHashTable:
+            (links, lists) = hash_table.memory_usage()
+            print("  memory_usage(): arrays %.1f MB, lists %.1f MB" %
+                  (links / 1e6, lists / 1e6))
+        del hash_table
+    print("Memory tests passed!")
+
+
+if __name__ == "__main__":
+    functional_test(CompactHashTable)
+    performance_test(CompactHashTable)
+    memory_test(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
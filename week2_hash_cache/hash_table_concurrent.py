@@ -0,0 +1,254 @@
+import random, threading, time
+
+from hash_table import Item, calculate_hash, functional_test, performance_test
+
+###########################################################################
+#                                                                         #
+# A thread-safe hash table with lock striping.                            #
+#                                                                         #
+# The keys are split into segments by their hash value. Each segment is a #
+# small chained hash table with its own lock, so writers to different     #
+# segments do not wait for each other. Readers take no lock.              #
+#                                                                         #
+###########################################################################
+
+
+# One segment of ConcurrentHashTable.
+#
+# |self.lock|: The lock taken by the writers of the segment.
+# |self.buckets|: The buckets of the segment. Readers take a reference to
+#                 the list once and use len() of it as the bucket size, so
+#                 replacing the list is seen by them all at once.
+# |self.item_count|: The number of items in the segment.
+# |self.rehashed|: True once the segment has been expanded.
+class Segment:
+    # The initial bucket size of a segment.
+    INITIAL_BUCKET_SIZE = 7
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [None] * self.INITIAL_BUCKET_SIZE
+        self.item_count = 0
+        self.rehashed = False
+
+
+# The thread-safe hash table. It has the same put / get / delete / size
+# interface as HashTable in hash_table.py.
+#
+# |stripes|: The number of the segments (locks).
+#
+# Writers (put and delete) lock the segment of the key. A chain is always
+# consistent: a new item is fully built before it is linked, and an unlinked
+# item keeps its |next|, so a reader walking the chain at the same time
+# either sees the change or not, but never a broken chain.
+#
+# Resize protocol: a segment is resized by copying its items to a new
+# bucket list while holding its lock, and then replacing the list. The old
+# items are not modified, so readers that still hold the old list finish
+# their lookup on it. Only the writers of that one segment wait.
+class ConcurrentHashTable:
+
+    def __init__(self, stripes=16, hash_function=None):
+        self.segments = [Segment() for i in range(stripes)]
+        self.hash_function = calculate_hash if hash_function is None else hash_function
+
+    # Return the segment of |hash| and the hash value used in the segment.
+    def segment_of(self, hash):
+        return (self.segments[hash % len(self.segments)],
+                hash // len(self.segments))
+
+    # Put an item to the hash table. If the key already exists, the
+    # corresponding value is updated to a new value.
+    #
+    # |key|: The key of the item.
+    # |value|: The value of the item.
+    # Return value: True if a new item is added. False if the key already exists
+    #               and the value is updated.
+    def put(self, key, value):
+        assert type(key) == str
+        segment, hash = self.segment_of(self.hash_function(key))
+        with segment.lock:
+            self.check_segment_size(segment) # Note: Don't remove this code.
+            buckets = segment.buckets
+            bucket_index = hash % len(buckets)
+            item = buckets[bucket_index]
+            while item:
+                if item.key == key:
+                    item.value = value
+                    return False
+                item = item.next
+            buckets[bucket_index] = Item(key, value, buckets[bucket_index])
+            segment.item_count += 1
+            if segment.item_count > len(buckets) * 0.7:
+                self.rehash(segment, len(buckets) * 2 + 1)
+                segment.rehashed = True
+        return True
+
+    # Get an item from the hash table. No lock is taken.
+    #
+    # |key|: The key.
+    # Return value: If the item is found, (the value of the item, True) is
+    #               returned. Otherwise, (None, False) is returned.
+    def get(self, key):
+        assert type(key) == str
+        segment, hash = self.segment_of(self.hash_function(key))
+        buckets = segment.buckets
+        item = buckets[hash % len(buckets)]
+        while item:
+            if item.key == key:
+                return (item.value, True)
+            item = item.next
+        return (None, False)
+
+    # Delete an item from the hash table.
+    #
+    # |key|: The key.
+    # Return value: True if the item is found and deleted successfully. False
+    #               otherwise.
+    def delete(self, key):
+        assert type(key) == str
+        segment, hash = self.segment_of(self.hash_function(key))
+        with segment.lock:
+            buckets = segment.buckets
+            bucket_index = hash % len(buckets)
+            item = buckets[bucket_index]
+            prev = None
+            while item:
+                if item.key == key:
+                    if prev == None:
+                        buckets[bucket_index] = item.next
+                    else:
+                        prev.next = item.next
+                    segment.item_count -= 1
+                    if (segment.item_count < len(buckets) * 0.3 and
+                            segment.rehashed and
+                            len(buckets) > Segment.INITIAL_BUCKET_SIZE):
+                        self.rehash(segment, len(buckets) >> 1)
+                    return True
+                prev = item
+                item = item.next
+        return False
+
+    # Return the total number of items in the hash table. While other
+    # threads are writing, this is a snapshot of the moment.
+    def size(self):
+        return sum(segment.item_count for segment in self.segments)
+
+    # Check that each segment has a "reasonable" bucket size, the same rule
+    # as HashTable.check_size() applied per segment.
+    def check_segment_size(self, segment):
+        assert (len(segment.buckets) < 100 or
+                segment.item_count >= len(segment.buckets) * 0.3)
+
+    def check_size(self):
+        for segment in self.segments:
+            self.check_segment_size(segment)
+
+    # Replace the buckets of |segment| with |bucket_size| new buckets. The
+    # caller holds the lock of the segment. The items are copied, not
+    # relinked, because readers may still be walking the old chains.
+    def rehash(self, segment, bucket_size):
+        stripes = len(self.segments)
+        buckets = [None] * bucket_size
+        for item in segment.buckets:
+            while item:
+                bucket_index = (self.hash_function(item.key) // stripes) % bucket_size
+                buckets[bucket_index] = Item(item.key, item.value,
+                                             buckets[bucket_index])
+                item = item.next
+        segment.buckets = buckets
+
+
+# Test the hash table from many threads at once.
+#
+# Each writer thread puts and deletes its own keys, so the final contents
+# can be checked. Reader threads look up shared keys that are never deleted
+# and must always find them, even while the segments are resized.
+def stress_test(thread_count=8, operations=20000):
+    hash_table = ConcurrentHashTable()
+    shared_keys = ["shared%d" % i for i in range(1000)]
+    for key in shared_keys:
+        hash_table.put(key, key)
+    errors = []
+    stop = threading.Event()
+
+    def writer(thread_id):
+        random.seed(thread_id)
+        mine = set()
+        for i in range(operations):
+            key = "%d-%d" % (thread_id, random.randint(0, operations // 2))
+            # An assert in a thread would not fail the test, so the errors
+            # are collected instead.
+            if random.random() < 0.7:
+                if hash_table.put(key, thread_id) != (key not in mine):
+                    errors.append(key)
+                mine.add(key)
+            else:
+                if hash_table.delete(key) != (key in mine):
+                    errors.append(key)
+                mine.discard(key)
+        for key in mine:
+            if hash_table.get(key) != (thread_id, True):
+                errors.append(key)
+        for key in mine:
+            hash_table.delete(key)
+
+    def reader():
+        while not stop.is_set():
+            for key in shared_keys:
+                if hash_table.get(key) != (key, True):
+                    errors.append(key)
+
+    readers = [threading.Thread(target=reader) for i in range(2)]
+    writers = [threading.Thread(target=writer, args=(i,))
+               for i in range(thread_count)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+    assert errors == [], errors[:10]
+    assert hash_table.size() == len(shared_keys)
+    hash_table.check_size()
+    print("Stress tests passed!")
+
+
+# Measure the throughput of mixed operations (80% get, 15% put, 5% delete)
+# with 1, 2, 4 and 8 threads.
+def throughput_test(operations=100000):
+    for thread_count in (1, 2, 4, 8):
+        hash_table = ConcurrentHashTable()
+        for i in range(10000):
+            hash_table.put(str(i), i)
+
+        def worker(thread_id):
+            random.seed(thread_id)
+            for i in range(operations // thread_count):
+                key = str(random.randint(0, 20000))
+                rand = random.random()
+                if rand < 0.8:
+                    hash_table.get(key)
+                elif rand < 0.95:
+                    hash_table.put(key, i)
+                else:
+                    hash_table.delete(key)
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(thread_count)]
+        begin = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        end = time.time()
+        print("%d threads %.0f ops/s" % (thread_count, operations / (end - begin)))
+    print("Throughput tests passed!")
+
+
+if __name__ == "__main__":
+    functional_test(ConcurrentHashTable)
+    performance_test(ConcurrentHashTable)
+    stress_test()
+    throughput_test()
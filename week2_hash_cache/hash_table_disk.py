@@ -0,0 +1,514 @@
+import mmap, os, pickle, random, struct, sys, tempfile, time
+
+from hash_functions import fnv1a_hash
+from hash_table import functional_test
+
+###########################################################################
+#                                                                         #
+# A persistent hash table on a memory-mapped file.                        #
+#                                                                         #
+# The buckets and the entries live in a file instead of Python objects,   #
+# so a table larger than RAM can be used, and it can be reopened without  #
+# being rebuilt.                                                          #
+#                                                                         #
+###########################################################################
+
+# Layout of the file (all integers are little endian):
+#
+#   header    MAGIC, bucket size, slot count, item count, used slots,
+#             free slot, overflow size, garbage size
+#   buckets   int64 x bucket size. The first slot of each bucket + 1, or 0.
+#   slots     SLOT x slot count. Fixed-size entries.
+#   overflow  The keys and values that do not fit in a slot.
+#
+# A slot has the hash value, the next slot + 1 (or 0), the key length, the
+# value length, the overflow offset, and INLINE_SIZE bytes of data. If the
+# key and the value fit in INLINE_SIZE bytes, they are stored in the slot.
+# Otherwise they are stored in the overflow region at the overflow offset.
+# When a value is replaced, the new data is written over the old overflow
+# data if it fits. The overflow bytes that are no longer used are counted as
+# garbage, and the table is compacted when the garbage exceeds the live data.
+# A free slot has the key length FREE and is linked from the free list.
+
+MAGIC = b'STEPHT01'
+HEADER = struct.Struct('<8sQQQQQQQ')
+HEADER_SIZE = 64
+# A bucket, and the next field of a slot.
+LINK = struct.Struct('<q')
+SLOT_HEADER = struct.Struct('<QqIIq')
+NEXT_OFFSET = 8
+INLINE_SIZE = 48
+SLOT_SIZE = SLOT_HEADER.size + INLINE_SIZE
+FREE = 0xFFFFFFFF
+INITIAL_OVERFLOW_SIZE = 4096
+
+
+# The hash function must give the same value in every process, so Python's
+# hash() can not be used.
+def disk_hash(key):
+    return fnv1a_hash(key)
+
+
+# Return the number of the slots for |bucket_size| buckets. A table is
+# expanded when the items exceed 70% of the buckets, so the slots never run
+# out.
+def slot_count(bucket_size):
+    return int(bucket_size * 0.7) + 1
+
+
+# Create an empty table file at |path|, and return the opened file and its
+# mmap.
+def create_file(path, bucket_size, overflow_size):
+    slots = slot_count(bucket_size)
+    size = (HEADER_SIZE + LINK.size * bucket_size + SLOT_SIZE * slots +
+            overflow_size)
+    f = open(path, 'w+b')
+    f.truncate(size)
+    data = mmap.mmap(f.fileno(), size)
+    HEADER.pack_into(data, 0, MAGIC, bucket_size, slots, 0, 0, 0, 0, 0)
+    return f, data
+
+
+# The persistent hash table. It has the same put / get / delete / size
+# interface as HashTable in hash_table.py. The keys are strings, and the
+# values are any picklable objects.
+#
+# |path|: The path of the file. If the file exists, the table in it is
+#         opened. Otherwise a new table is created.
+#
+# The header fields are cached in the attributes and written back after
+# every change, so the table is consistent even if it is not closed.
+class DiskHashTable:
+
+    # Open or create the hash table at |path|.
+    def __init__(self, path, bucket_size=None):
+        self.path = path
+        # Remove the file of a resize that did not finish.
+        if os.path.exists(path + ".resize"):
+            os.remove(path + ".resize")
+        if os.path.exists(path):
+            self.file = open(path, 'r+b')
+            self.data = mmap.mmap(self.file.fileno(), 0)
+        else:
+            # Set the initial bucket size to 97. A prime number is chosen to
+            # reduce hash conflicts.
+            self.file, self.data = create_file(
+                path, 97 if bucket_size==None else bucket_size,
+                INITIAL_OVERFLOW_SIZE)
+        self.read_header()
+
+    def read_header(self):
+        (magic, self.bucket_size, self.slot_count, self.item_count,
+         self.used_slots, self.free_slot, self.overflow_size,
+         self.garbage_size) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a hash table file" % self.path)
+        self.slots_offset = HEADER_SIZE + LINK.size * self.bucket_size
+        self.overflow_offset = self.slots_offset + SLOT_SIZE * self.slot_count
+
+    def write_header(self):
+        HEADER.pack_into(self.data, 0, MAGIC, self.bucket_size,
+                         self.slot_count, self.item_count, self.used_slots,
+                         self.free_slot, self.overflow_size, self.garbage_size)
+
+    # Write the changes to the disk.
+    def flush(self):
+        self.write_header()
+        self.data.flush()
+
+    def close(self):
+        if self.data is None:
+            return
+        self.flush()
+        self.data.close()
+        self.file.close()
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def bucket_offset(self, bucket_index):
+        return HEADER_SIZE + LINK.size * bucket_index
+
+    def slot_offset(self, slot):
+        return self.slots_offset + SLOT_SIZE * slot
+
+    # Return the key and the value bytes of |slot|.
+    def read_data(self, slot, key_length, value_length, overflow):
+        if overflow < 0:
+            begin = self.slot_offset(slot) + SLOT_HEADER.size
+        else:
+            begin = self.overflow_offset + overflow
+        middle = begin + key_length
+        return self.data[begin:middle], self.data[middle:middle + value_length]
+
+    # Return (slot, previous slot) of |key|. The slot is -1 if the key is not
+    # found. Only the bucket and the slots in its chain are read.
+    def find(self, key_bytes, hash):
+        prev = -1
+        slot = LINK.unpack_from(self.data, self.bucket_offset(
+            hash % self.bucket_size))[0] - 1
+        while slot >= 0:
+            (slot_hash, next, key_length, value_length, overflow) = \
+                SLOT_HEADER.unpack_from(self.data, self.slot_offset(slot))
+            if slot_hash == hash and key_length == len(key_bytes):
+                if self.read_data(slot, key_length, 0, overflow)[0] == key_bytes:
+                    return slot, prev
+            prev = slot
+            slot = next - 1
+        return -1, prev
+
+    # Store the key and the value in |slot|.
+    #
+    # |old_overflow|, |old_length|: The overflow data of the previous value
+    #                               of the slot, or -1 and 0. It is reused
+    #                               if the new data fits in it, and the
+    #                               bytes left unused are counted as garbage.
+    def write_slot(self, slot, hash, next, key_bytes, value_bytes,
+                   old_overflow=-1, old_length=0):
+        data = key_bytes + value_bytes
+        if len(data) <= INLINE_SIZE:
+            overflow = -1
+            self.data[self.slot_offset(slot) + SLOT_HEADER.size:
+                      self.slot_offset(slot) + SLOT_HEADER.size + len(data)] = data
+        else:
+            if old_overflow >= 0 and len(data) <= old_length:
+                overflow = old_overflow
+            else:
+                overflow = self.allocate_overflow(len(data))
+            self.data[self.overflow_offset + overflow:
+                      self.overflow_offset + overflow + len(data)] = data
+        if old_overflow >= 0:
+            self.garbage_size += old_length
+            if overflow == old_overflow:
+                self.garbage_size -= len(data)
+        SLOT_HEADER.pack_into(self.data, self.slot_offset(slot), hash, next,
+                              len(key_bytes), len(value_bytes), overflow)
+
+    # Reserve |length| bytes in the overflow region and return the offset.
+    # The file is extended when the region is full.
+    def allocate_overflow(self, length):
+        offset = self.overflow_size
+        end = self.overflow_offset + offset + length
+        if end > len(self.data):
+            self.data.flush()
+            new_size = max(end, len(self.data) * 2)
+            self.file.truncate(new_size)
+            self.data.resize(new_size)
+        self.overflow_size += length
+        return offset
+
+    # Put an item to the hash table. If the key already exists, the
+    # corresponding value is updated to a new value.
+    #
+    # |key|: The key of the item.
+    # |value|: The value of the item.
+    # Return value: True if a new item is added. False if the key already exists
+    #               and the value is updated.
+    def put(self, key, value):
+        assert type(key) == str
+        self.check_size() # Note: Don't remove this code.
+        key_bytes = key.encode()
+        value_bytes = pickle.dumps(value)
+        hash = disk_hash(key)
+        slot, prev = self.find(key_bytes, hash)
+        if slot >= 0:
+            (old_hash, next, key_length, value_length, overflow) = \
+                SLOT_HEADER.unpack_from(self.data, self.slot_offset(slot))
+            self.write_slot(slot, hash, next, key_bytes, value_bytes,
+                            overflow, key_length + value_length)
+            self.write_header()
+            self.check_garbage()
+            return False
+        if self.free_slot == 0 and self.used_slots == self.slot_count:
+            # The slots taken by the crashed puts have run out the slots.
+            self.resize(self.bucket_size)
+        if self.free_slot > 0:
+            slot = self.free_slot - 1
+            self.free_slot = SLOT_HEADER.unpack_from(
+                self.data, self.slot_offset(slot))[1]
+        else:
+            slot = self.used_slots
+            self.used_slots += 1
+        # Take the slot in the header first, so that a crash never gives the
+        # slot to another key while it is linked.
+        self.write_header()
+        bucket_offset = self.bucket_offset(hash % self.bucket_size)
+        head = LINK.unpack_from(self.data, bucket_offset)[0]
+        # Write the slot before linking it, so that a crash never leaves a
+        # link to a half-written slot.
+        self.write_slot(slot, hash, head, key_bytes, value_bytes)
+        LINK.pack_into(self.data, bucket_offset, slot + 1)
+        self.item_count += 1
+        self.write_header()
+
+        if self.item_count > self.bucket_size * 0.7:
+            self.resize(self.bucket_size * 2 + 1)
+        return True
+
+    # Get an item from the hash table.
+    #
+    # |key|: The key.
+    # Return value: If the item is found, (the value of the item, True) is
+    #               returned. Otherwise, (None, False) is returned.
+    def get(self, key):
+        assert type(key) == str
+        self.check_size() # Note: Don't remove this code.
+        slot = self.find(key.encode(), disk_hash(key))[0]
+        if slot < 0:
+            return (None, False)
+        (hash, next, key_length, value_length, overflow) = \
+            SLOT_HEADER.unpack_from(self.data, self.slot_offset(slot))
+        value_bytes = self.read_data(slot, key_length, value_length, overflow)[1]
+        return (pickle.loads(value_bytes), True)
+
+    # Delete an item from the hash table. The slot is added to the free list.
+    #
+    # |key|: The key.
+    # Return value: True if the item is found and deleted successfully. False
+    #               otherwise.
+    def delete(self, key):
+        assert type(key) == str
+        hash = disk_hash(key)
+        slot, prev = self.find(key.encode(), hash)
+        if slot < 0:
+            return False
+        (slot_hash, next, key_length, value_length, overflow) = \
+            SLOT_HEADER.unpack_from(self.data, self.slot_offset(slot))
+        if prev < 0:
+            LINK.pack_into(self.data, self.bucket_offset(hash % self.bucket_size),
+                             next)
+        else:
+            LINK.pack_into(self.data, self.slot_offset(prev) + NEXT_OFFSET, next)
+        SLOT_HEADER.pack_into(self.data, self.slot_offset(slot), 0,
+                              self.free_slot, FREE, 0, -1)
+        self.free_slot = slot + 1
+        self.item_count -= 1
+        if overflow >= 0:
+            self.garbage_size += key_length + value_length
+        self.write_header()
+        if self.item_count < self.bucket_size * 0.3 and self.bucket_size > 100:
+            self.resize(self.bucket_size >> 1)
+        else:
+            self.check_garbage()
+        return True
+
+    # Return the total number of items in the hash table.
+    def size(self):
+        return self.item_count
+
+    # Check that the hash table has a "reasonable" bucket size.
+    # The bucket size is judged "reasonable" if it is smaller than 100 or
+    # the buckets are 30% or more used.
+    def check_size(self):
+        assert (self.bucket_size < 100 or
+                self.item_count >= self.bucket_size * 0.3)
+
+    # Compact the overflow region when more than half of it is garbage.
+    def check_garbage(self):
+        if (self.garbage_size > INITIAL_OVERFLOW_SIZE and
+                self.garbage_size * 2 > self.overflow_size):
+            self.resize(self.bucket_size)
+
+    # Rebuild the table with |bucket_size| buckets.
+    #
+    # The new table is written to a separate file, synced, and then renamed
+    # over the old file. If the process crashes in the middle, the old file
+    # is left as it was, and the separate file is removed on the next open.
+    # The free slots and the garbage of the overflow region are dropped.
+    #
+    # Only the items linked from the buckets are copied, and they are
+    # counted again. A crash in the middle of put() or delete() can leave a
+    # slot that is taken but not linked, or an item that is linked but not
+    # counted yet; the rebuilt table has neither.
+    def resize(self, bucket_size):
+        live_slots = []
+        live_overflow_size = 0
+        for bucket_index in range(self.bucket_size):
+            slot = LINK.unpack_from(self.data, self.bucket_offset(bucket_index))[0] - 1
+            while slot >= 0:
+                live_slots.append(slot)
+                (hash, next, key_length, value_length, overflow) = \
+                    SLOT_HEADER.unpack_from(self.data, self.slot_offset(slot))
+                if overflow >= 0:
+                    live_overflow_size += key_length + value_length
+                slot = next - 1
+        while len(live_slots) > slot_count(bucket_size):
+            bucket_size = bucket_size * 2 + 1
+        temp_path = self.path + ".resize"
+        f, data = create_file(temp_path, bucket_size,
+                              max(live_overflow_size, INITIAL_OVERFLOW_SIZE))
+        new_slots_offset = HEADER_SIZE + LINK.size * bucket_size
+        new_overflow_offset = new_slots_offset + SLOT_SIZE * slot_count(bucket_size)
+        new_slot = 0
+        overflow_size = 0
+        for slot in live_slots:
+            offset = self.slot_offset(slot)
+            (hash, next, key_length, value_length, overflow) = \
+                SLOT_HEADER.unpack_from(self.data, offset)
+            new_offset = new_slots_offset + SLOT_SIZE * new_slot
+            if overflow >= 0:
+                length = key_length + value_length
+                begin = self.overflow_offset + overflow
+                data[new_overflow_offset + overflow_size:
+                     new_overflow_offset + overflow_size + length] = \
+                    self.data[begin:begin + length]
+                overflow = overflow_size
+                overflow_size += length
+            else:
+                data[new_offset + SLOT_HEADER.size:new_offset + SLOT_SIZE] = \
+                    self.data[offset + SLOT_HEADER.size:offset + SLOT_SIZE]
+            bucket_offset = HEADER_SIZE + LINK.size * (hash % bucket_size)
+            head = LINK.unpack_from(data, bucket_offset)[0]
+            SLOT_HEADER.pack_into(data, new_offset, hash, head, key_length,
+                                  value_length, overflow)
+            LINK.pack_into(data, bucket_offset, new_slot + 1)
+            new_slot += 1
+        HEADER.pack_into(data, 0, MAGIC, bucket_size, slot_count(bucket_size),
+                         new_slot, new_slot, 0, overflow_size, 0)
+        data.flush()
+        os.fsync(f.fileno())
+        data.close()
+        f.close()
+        self.data.close()
+        self.file.close()
+        os.replace(temp_path, self.path)
+        # Make the rename itself durable.
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.file = open(self.path, 'r+b')
+        self.data = mmap.mmap(self.file.fileno(), 0)
+        self.read_header()
+
+
+# Test that the items survive closing and reopening the table.
+def persistence_test(n=100000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "table")
+        random.seed(0)
+        keys = [str(random.randint(0, 100000000)) for i in range(n)]
+        begin = time.time()
+        with DiskHashTable(path) as hash_table:
+            for key in keys:
+                hash_table.put(key, key)
+            # Keys and values longer than a slot go to the overflow region.
+            assert hash_table.put("long" * 20, "value" * 100) == True
+        end = time.time()
+        print("put %d items: %.6f s" % (n, end - begin))
+
+        begin = time.time()
+        with DiskHashTable(path) as hash_table:
+            opened = time.time()
+            for key in keys:
+                assert hash_table.get(key) == (key, True)
+            assert hash_table.get("long" * 20) == ("value" * 100, True)
+            assert hash_table.get("missing") == (None, False)
+            size = hash_table.size()
+            for key in keys:
+                hash_table.delete(key)
+            assert hash_table.size() == 1
+        end = time.time()
+        print("reopen: %.6f s, get and delete %d items: %.6f s" %
+              (opened - begin, size, end - opened))
+
+        # A table that is dropped without close(), as in a crash, is opened
+        # with the right counters, and new items do not overwrite old ones.
+        path = os.path.join(directory, "crashed")
+        hash_table = DiskHashTable(path)
+        for key in keys[:1000]:
+            hash_table.put(key, key)
+        for key in keys[:100]:
+            hash_table.delete(key)
+        hash_table.put("long" * 20, "value" * 100)
+        expected = hash_table.size()
+        del hash_table
+        hash_table = DiskHashTable(path)
+        assert hash_table.size() == expected
+        for i in range(10):
+            assert hash_table.put("new%d" % i, i) == True
+        for key in keys[100:1000]:
+            assert hash_table.get(key) == (key, True)
+        for key in keys[:100]:
+            assert hash_table.get(key) == (None, False)
+        assert hash_table.get("long" * 20) == ("value" * 100, True)
+        assert hash_table.size() == expected + 10
+        hash_table.close()
+
+        # A crash in the middle of put() leaves the table usable, and it can
+        # still grow.
+        class Crash(Exception):
+            pass
+        def crash(*args):
+            raise Crash()
+        path = os.path.join(directory, "interrupted")
+        hash_table = DiskHashTable(path)
+        for key in keys[:1000]:
+            hash_table.put(key, key)
+        # The slot is taken, but not written nor linked.
+        hash_table.write_slot = crash
+        try:
+            hash_table.put("crash1", 1)
+            assert False
+        except Crash:
+            pass
+        del hash_table
+        # The item is linked, but not counted.
+        hash_table = DiskHashTable(path)
+        write_header = hash_table.write_header
+        calls = [0]
+        def crash_at_second_call():
+            calls[0] += 1
+            if calls[0] == 2:
+                crash()
+            write_header()
+        hash_table.write_header = crash_at_second_call
+        try:
+            hash_table.put("crash2", 2)
+            assert False
+        except Crash:
+            pass
+        del hash_table
+        # The table is expanded and the items are counted again.
+        hash_table = DiskHashTable(path)
+        bucket_size = hash_table.bucket_size
+        for key in keys[1000:3000]:
+            hash_table.put(key, key)
+        assert hash_table.bucket_size > bucket_size
+        for key in keys[:3000]:
+            assert hash_table.get(key) == (key, True)
+        assert hash_table.get("crash1") == (None, False)
+        assert hash_table.get("crash2") == (2, True)
+        assert hash_table.size() == len(set(keys[:3000])) + 1
+        hash_table.close()
+
+        # Replacing a value reuses its overflow data, and the garbage of the
+        # values that do not fit is compacted.
+        path = os.path.join(directory, "overflow")
+        with DiskHashTable(path) as hash_table:
+            for i in range(20000):
+                hash_table.put("key", "v" * 1000)
+            assert os.path.getsize(path) < 100000
+            for i in range(20000):
+                hash_table.put("key", "v" * (1000 + i % 1000))
+            assert hash_table.garbage_size * 2 <= hash_table.overflow_size
+            assert os.path.getsize(path) < 100000
+            for i in range(100):
+                hash_table.put(str(i), "v" * 1000)
+            for i in range(100):
+                hash_table.delete(str(i))
+            assert hash_table.garbage_size * 2 <= hash_table.overflow_size
+            assert hash_table.get("key") == ("v" * 1999, True)
+            assert hash_table.size() == 1
+    print("Persistence tests passed!")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        functional_test(lambda: DiskHashTable(os.path.join(directory, "table")))
+    persistence_test(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,187 @@
+from array import array
+
+from hash_table import (HashTableStats, calculate_hash, functional_test,
+                        performance_test)
+
+###########################################################################
+#                                                                         #
+# A hash table with open addressing.                                      #
+#                                                                         #
+# HashTable in hash_table.py chains Item objects, so every lookup follows #
+# object pointers. This variant stores the items in parallel arrays and   #
+# resolves conflicts with linear probing.                                 #
+#                                                                         #
+###########################################################################
+
+# The marker of a deleted slot (a tombstone). A probe continues over a
+# tombstone, and put() can reuse it.
+DELETED = object()
+
+
+# The hash table with open addressing. It has the same put / get / delete /
+# size interface as HashTable in hash_table.py.
+#
+# |self.bucket_size|: The number of the slots.
+# |self.hashes|: self.hashes[i] is the hash value of the key in the slot i.
+#                The hash values are machine integers in array.array, not
+#                int objects.
+# |self.keys|: self.keys[i] is the key in the slot i, None if the slot is
+#              empty, or DELETED if the item in the slot is deleted.
+# |self.values|: self.values[i] is the value in the slot i.
+# |self.item_count|: The total number of items in the hash table.
+# |self.deleted_count|: The number of the tombstones.
+# |self.hash_function|: The hash function. calculate_hash() by default.
+class OpenAddressingHashTable:
+
+    # Initialize the hash table.
+    def __init__(self, bucket_size=None, hash_function=None):
+        # Set the initial bucket size to 97. A prime number is chosen to reduce
+        # hash conflicts.
+        self.bucket_size = 97 if bucket_size==None else bucket_size
+        self.hashes = array('Q', [0]) * self.bucket_size
+        self.keys = [None] * self.bucket_size
+        self.values = [None] * self.bucket_size
+        self.item_count = 0
+        self.deleted_count = 0
+        self.rehashed = False
+        self.hash_function = calculate_hash if hash_function is None else hash_function
+
+    # Return the slot of |key|, or -1 if |key| is not in the hash table.
+    def find(self, key, hash):
+        keys = self.keys
+        index = hash % self.bucket_size
+        while keys[index] is not None:
+            if keys[index] == key and self.hashes[index] == hash:
+                return index
+            index += 1
+            if index == self.bucket_size:
+                index = 0
+        return -1
+
+    # Put an item to the hash table. If the key already exists, the
+    # corresponding value is updated to a new value.
+    #
+    # |key|: The key of the item.
+    # |value|: The value of the item.
+    # Return value: True if a new item is added. False if the key already exists
+    #               and the value is updated.
+    def put(self, key, value):
+        assert type(key) == str
+        self.check_size() # Note: Don't remove this code.
+        hash = self.hash_function(key)
+        keys = self.keys
+        index = hash % self.bucket_size
+        deleted_index = -1
+        while keys[index] is not None:
+            if keys[index] is DELETED:
+                if deleted_index == -1:
+                    deleted_index = index
+            elif keys[index] == key and self.hashes[index] == hash:
+                self.values[index] = value
+                return False
+            index += 1
+            if index == self.bucket_size:
+                index = 0
+        if deleted_index != -1:
+            index = deleted_index
+            self.deleted_count -= 1
+        self.hashes[index] = hash
+        keys[index] = key
+        self.values[index] = value
+        self.item_count += 1
+
+        if self.item_count + self.deleted_count > self.bucket_size * 0.7:
+            if self.item_count > self.bucket_size * 0.5:
+                self.rehash(self.bucket_size * 2 + 1)
+                self.rehashed = True
+            else:
+                # Mostly tombstones. Clean them up without growing.
+                self.rehash(self.bucket_size)
+        return True
+
+    # Get an item from the hash table.
+    #
+    # |key|: The key.
+    # Return value: If the item is found, (the value of the item, True) is
+    #               returned. Otherwise, (None, False) is returned.
+    def get(self, key):
+        assert type(key) == str
+        self.check_size() # Note: Don't remove this code.
+        index = self.find(key, self.hash_function(key))
+        if index == -1:
+            return (None, False)
+        return (self.values[index], True)
+
+    # Delete an item from the hash table. The slot becomes a tombstone so that
+    # the probes of the other keys are not cut.
+    #
+    # |key|: The key.
+    # Return value: True if the item is found and deleted successfully. False
+    #               otherwise.
+    def delete(self, key):
+        assert type(key) == str
+        index = self.find(key, self.hash_function(key))
+        if index == -1:
+            return False
+        self.keys[index] = DELETED
+        self.values[index] = None
+        self.item_count -= 1
+        self.deleted_count += 1
+        if (self.item_count < self.bucket_size * 0.3 and self.rehashed and
+                self.bucket_size > 100):
+            self.rehash(self.bucket_size >> 1)
+        return True
+
+    # Return the total number of items in the hash table.
+    def size(self):
+        return self.item_count
+
+    # Return the statistics of the probe lengths. The probe length of an item
+    # is the number of the slots checked to find it.
+    def stats(self):
+        histogram = []
+        for index in range(self.bucket_size):
+            key = self.keys[index]
+            if key is None or key is DELETED:
+                continue
+            length = (index - self.hashes[index] % self.bucket_size) % self.bucket_size + 1
+            while len(histogram) <= length:
+                histogram.append(0)
+            histogram[length] += 1
+        return HashTableStats(self.item_count, self.bucket_size, histogram)
+
+    # Check that the hash table has a "reasonable" bucket size.
+    # The bucket size is judged "reasonable" if it is smaller than 100 or
+    # the buckets are 30% or more used.
+    def check_size(self):
+        assert (self.bucket_size < 100 or
+                self.item_count >= self.bucket_size * 0.3)
+
+    # Move all the items to new arrays of |bucket_size| slots. The stored
+    # hash values are reused, and the tombstones are dropped.
+    def rehash(self, bucket_size):
+        prev_hashes, prev_keys, prev_values = self.hashes, self.keys, self.values
+        self.bucket_size = bucket_size
+        self.hashes = array('Q', [0]) * bucket_size
+        self.keys = [None] * bucket_size
+        self.values = [None] * bucket_size
+        self.deleted_count = 0
+        keys = self.keys
+        for i in range(len(prev_keys)):
+            key = prev_keys[i]
+            if key is None or key is DELETED:
+                continue
+            hash = prev_hashes[i]
+            index = hash % bucket_size
+            while keys[index] is not None:
+                index += 1
+                if index == bucket_size:
+                    index = 0
+            self.hashes[index] = hash
+            keys[index] = key
+            self.values[index] = prev_values[i]
+
+
+if __name__ == "__main__":
+    functional_test(OpenAddressingHashTable)
+    performance_test(OpenAddressingHashTable)
@@ -0,0 +1,421 @@
+import multiprocessing, random, struct, sys, time
+from multiprocessing import Pool, shared_memory
+
+from cache import Cache, CacheStats, cache_test
+from hash_functions import fnv1a_hash
+
+###########################################################################
+#                                                                         #
+# A sharded page cache in shared memory.                                  #
+#                                                                         #
+# Every worker process of a crawler would have its own cold Cache. This   #
+# cache keeps the index and the contents in one SharedMemory block, so    #
+# the processes share one warm cache. The contents are copied in and out  #
+# as raw bytes, never pickled.                                            #
+#                                                                         #
+# The keys are split into shards by their hash value. Each shard has its  #
+# own lock, hash index, LRU list and slab of fixed-size slots, so the     #
+# processes working on different shards do not wait for each other.      #
+#                                                                         #
+###########################################################################
+
+# Layout of the shared memory (all integers are little endian):
+#
+#   header   MAGIC, shard count, slots per shard, slot size, bucket count
+#   shard 0  shard header, buckets, slot headers, slot data
+#   shard 1  ...
+#
+# A shard header has the item count, the LRU head and tail, the first free
+# slot, the hits, the misses and the total bytes of the contents. A bucket
+# is the first slot of its chain. A slot header has the hash value, the
+# next slot in the chain (or in the free list), the previous and the next
+# slot in the LRU list, the key length, the kind of the contents and the
+# contents length. The key and then the contents are stored in the slot
+# data. A link is a slot index, or NONE.
+
+MAGIC = b'STEPSC01'
+HEADER = struct.Struct('<8sIIII')
+HEADER_SIZE = 64
+SHARD_HEADER = struct.Struct('<iiiiQQQ')
+LINK = struct.Struct('<i')
+SLOT = struct.Struct('<QiiiHBxI')
+CHAIN_OFFSET = 8
+PREV_OFFSET = 12
+NEXT_OFFSET = 16
+NONE = -1
+# The kinds of the contents. A str is stored encoded in UTF-8.
+BYTES = 0
+STR = 1
+
+
+# The shared page cache. It has the same access_page / get / get_pages /
+# stats interface as Cache in cache.py. The contents must be str or bytes.
+#
+# |name|: The name of the SharedMemory block to attach to. If None, a new
+#         cache is created.
+# |locks|: The locks of the shards, from the |locks| of the creator. A lock
+#          can not be found by name, so it is passed to the worker processes
+#          when they start (see init_worker()).
+# |shards|: The number of the shards.
+# |slots|: The number of the pages in a shard.
+# |slot_size|: The bytes for a URL and its contents. A larger page is not
+#              cached.
+#
+# The LRU order is per shard. get_pages() returns the pages shard by shard.
+class SharedCache:
+    def __init__(self, name=None, locks=None, shards=16, slots=1024,
+                 slot_size=16384):
+        if name is None:
+            bucket_count = slots * 2 + 1
+            size = HEADER_SIZE + shards * self.shard_size(slots, slot_size,
+                                                          bucket_count)
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+            HEADER.pack_into(self.memory.buf, 0, MAGIC, shards, slots,
+                             slot_size, bucket_count)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.buf = self.memory.buf
+        self.name = self.memory.name
+        (magic, self.shards, self.slots, self.slot_size,
+         self.bucket_count) = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a shared cache" % name)
+        self.buckets_offset = SHARD_HEADER.size
+        self.slots_offset = self.buckets_offset + LINK.size * self.bucket_count
+        self.data_offset = self.slots_offset + SLOT.size * self.slots
+        if self.owner:
+            for shard in range(self.shards):
+                self.clear_shard(self.shard_base(shard))
+            locks = [multiprocessing.Lock() for i in range(self.shards)]
+        assert locks is not None and len(locks) == self.shards
+        self.locks = locks
+
+    @staticmethod
+    def shard_size(slots, slot_size, bucket_count):
+        return (SHARD_HEADER.size + LINK.size * bucket_count +
+                (SLOT.size + slot_size) * slots)
+
+    def shard_base(self, shard):
+        return HEADER_SIZE + shard * self.shard_size(
+            self.slots, self.slot_size, self.bucket_count)
+
+    # Empty the shard at |base|. All the slots go to the free list.
+    def clear_shard(self, base):
+        SHARD_HEADER.pack_into(self.buf, base, 0, NONE, NONE, 0, 0, 0, 0)
+        for bucket_index in range(self.bucket_count):
+            LINK.pack_into(self.buf, base + self.buckets_offset +
+                           LINK.size * bucket_index, NONE)
+        for slot in range(self.slots):
+            next = slot + 1 if slot + 1 < self.slots else NONE
+            SLOT.pack_into(self.buf, self.slot_offset(base, slot),
+                           0, next, NONE, NONE, 0, 0, 0)
+
+    def close(self):
+        if self.buf is None:
+            return
+        self.buf.release()
+        self.buf = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def slot_offset(self, base, slot):
+        return base + self.slots_offset + SLOT.size * slot
+
+    def bucket_offset(self, base, hash):
+        return (base + self.buckets_offset +
+                LINK.size * (hash // self.shards % self.bucket_count))
+
+    def get_link(self, offset):
+        return LINK.unpack_from(self.buf, offset)[0]
+
+    def set_link(self, offset, slot):
+        LINK.pack_into(self.buf, offset, slot)
+
+    # Return the shard index and the base offset of the shard of |hash|.
+    def shard_of(self, hash):
+        shard = hash % self.shards
+        return (shard, self.shard_base(shard))
+
+    # Return the slot of |key_bytes|, or NONE.
+    def find(self, base, key_bytes, hash):
+        slot = self.get_link(self.bucket_offset(base, hash))
+        while slot != NONE:
+            offset = self.slot_offset(base, slot)
+            (slot_hash, next, prev, lru_next, key_length, kind,
+             value_length) = SLOT.unpack_from(self.buf, offset)
+            if slot_hash == hash and key_length == len(key_bytes):
+                data = base + self.data_offset + self.slot_size * slot
+                if self.buf[data:data + key_length] == key_bytes:
+                    return slot
+            slot = next
+        return NONE
+
+    # Remove |slot| from the LRU list.
+    def lru_unlink(self, base, header, slot):
+        offset = self.slot_offset(base, slot)
+        prev = self.get_link(offset + PREV_OFFSET)
+        next = self.get_link(offset + NEXT_OFFSET)
+        if prev == NONE:
+            header[1] = next
+        else:
+            self.set_link(self.slot_offset(base, prev) + NEXT_OFFSET, next)
+        if next == NONE:
+            header[2] = prev
+        else:
+            self.set_link(self.slot_offset(base, next) + PREV_OFFSET, prev)
+
+    # Insert |slot| at the front of the LRU list.
+    def lru_push_front(self, base, header, slot):
+        offset = self.slot_offset(base, slot)
+        head = header[1]
+        self.set_link(offset + PREV_OFFSET, NONE)
+        self.set_link(offset + NEXT_OFFSET, head)
+        if head == NONE:
+            header[2] = slot
+        else:
+            self.set_link(self.slot_offset(base, head) + PREV_OFFSET, slot)
+        header[1] = slot
+
+    # Remove |slot| from its chain and the LRU list, and free it.
+    def remove(self, base, header, slot):
+        offset = self.slot_offset(base, slot)
+        (hash, chain_next, prev, next, key_length, kind,
+         value_length) = SLOT.unpack_from(self.buf, offset)
+        link = self.bucket_offset(base, hash)
+        while self.get_link(link) != slot:
+            link = self.slot_offset(base, self.get_link(link)) + CHAIN_OFFSET
+        self.set_link(link, chain_next)
+        self.lru_unlink(base, header, slot)
+        self.set_link(offset + CHAIN_OFFSET, header[3])
+        header[3] = slot
+        header[0] -= 1
+        header[6] -= value_length
+
+    # Access a page. Same as Cache.access_page().
+    # |url|: The accessed URL
+    # |contents|: The contents of the URL, str or bytes
+    def access_page(self, url, contents):
+        key_bytes = url.encode()
+        if isinstance(contents, str):
+            (kind, value) = (STR, contents.encode())
+        else:
+            (kind, value) = (BYTES, contents)
+        hash = fnv1a_hash(url)
+        (shard, base) = self.shard_of(hash)
+        with self.locks[shard]:
+            header = list(SHARD_HEADER.unpack_from(self.buf, base))
+            slot = self.find(base, key_bytes, hash)
+            if slot != NONE:
+                header[4] += 1
+                self.remove(base, header, slot)
+            else:
+                header[5] += 1
+            if len(key_bytes) + len(value) <= self.slot_size:
+                self.insert(base, header, key_bytes, hash, kind, value)
+            SHARD_HEADER.pack_into(self.buf, base, *header)
+
+    # Store a new page in a free slot, or in the slot of the least recently
+    # accessed page.
+    def insert(self, base, header, key_bytes, hash, kind, value):
+        if header[3] == NONE:
+            self.remove(base, header, header[2])
+        slot = header[3]
+        offset = self.slot_offset(base, slot)
+        header[3] = self.get_link(offset + CHAIN_OFFSET)
+        bucket = self.bucket_offset(base, hash)
+        SLOT.pack_into(self.buf, offset, hash, self.get_link(bucket),
+                       NONE, NONE, len(key_bytes), kind, len(value))
+        self.set_link(bucket, slot)
+        self.lru_push_front(base, header, slot)
+        data = base + self.data_offset + self.slot_size * slot
+        self.buf[data:data + len(key_bytes)] = key_bytes
+        data += len(key_bytes)
+        self.buf[data:data + len(value)] = value
+        header[0] += 1
+        header[6] += len(value)
+
+    # Get the contents of a cached page. Same as Cache.get().
+    # |url|: The URL
+    # Return value: (the contents, True) if the page is cached. Otherwise,
+    #               (None, False).
+    def get(self, url):
+        key_bytes = url.encode()
+        hash = fnv1a_hash(url)
+        (shard, base) = self.shard_of(hash)
+        with self.locks[shard]:
+            header = list(SHARD_HEADER.unpack_from(self.buf, base))
+            slot = self.find(base, key_bytes, hash)
+            if slot == NONE:
+                header[5] += 1
+                SHARD_HEADER.pack_into(self.buf, base, *header)
+                return (None, False)
+            header[4] += 1
+            self.lru_unlink(base, header, slot)
+            self.lru_push_front(base, header, slot)
+            SHARD_HEADER.pack_into(self.buf, base, *header)
+            (hash, next, prev, lru_next, key_length, kind,
+             value_length) = SLOT.unpack_from(self.buf,
+                                              self.slot_offset(base, slot))
+            data = base + self.data_offset + self.slot_size * slot + key_length
+            value = bytes(self.buf[data:data + value_length])
+        return (value.decode() if kind == STR else value, True)
+
+    # Iterate the URLs of the cached pages lazily, shard by shard. Each
+    # shard is read under its lock, from the most recently accessed page.
+    def iter_pages(self):
+        for shard in range(self.shards):
+            base = self.shard_base(shard)
+            urls = []
+            with self.locks[shard]:
+                slot = SHARD_HEADER.unpack_from(self.buf, base)[1]
+                while slot != NONE:
+                    (hash, chain_next, prev, next, key_length, kind,
+                     value_length) = SLOT.unpack_from(
+                         self.buf, self.slot_offset(base, slot))
+                    data = base + self.data_offset + self.slot_size * slot
+                    urls.append(bytes(self.buf[data:data + key_length]).decode())
+                    slot = next
+            yield from urls
+
+    def get_pages(self):
+        return list(self.iter_pages())
+
+    # Return the statistics of all the shards. The byte hits and misses are
+    # not counted.
+    def stats(self):
+        page_count = hits = misses = total_bytes = 0
+        for shard in range(self.shards):
+            header = SHARD_HEADER.unpack_from(self.buf, self.shard_base(shard))
+            page_count += header[0]
+            hits += header[4]
+            misses += header[5]
+            total_bytes += header[6]
+        return CacheStats(hits, misses, 0, 0, page_count, total_bytes)
+
+
+# The cache of this worker process.
+worker_cache = None
+
+
+def init_worker(name, locks):
+    global worker_cache
+    worker_cache = SharedCache(name, locks)
+
+
+# Return the contents of the page |url|. It stands for a slow fetch.
+def fetch(url):
+    return ("<html>%s</html>" % url) * 20
+
+
+# Read the pages of |urls| through the cache of this worker, and return the
+# number of the fetches. Every page must come back with its own contents.
+def crawl(urls):
+    fetches = 0
+    for url in urls:
+        (contents, found) = worker_cache.get(url)
+        if found:
+            assert contents == fetch(url)
+        else:
+            worker_cache.access_page(url, fetch(url))
+            fetches += 1
+    return fetches
+
+
+# A private Cache for each worker, for the comparison.
+def crawl_private(args):
+    (urls, n) = args
+    global worker_cache
+    if worker_cache is None:
+        worker_cache = Cache(n)
+    return crawl(urls)
+
+
+def shared_cache_test():
+    # With one shard, the cache is an LRU cache of |slots| pages.
+    caches = []
+
+    def cache_class(n):
+        caches.append(SharedCache(shards=1, slots=n))
+        return caches[-1]
+
+    cache_test(cache_class)
+    for cache in caches:
+        cache.close()
+
+    with SharedCache(shards=4, slots=8, slot_size=64) as cache:
+        cache.access_page("a.com", b"\x00\x01")
+        assert cache.get("a.com") == (b"\x00\x01", True)
+        cache.access_page("a.com", "AAA")
+        assert cache.get("a.com") == ("AAA", True)
+        # A page larger than a slot is not cached, and its old contents are
+        # removed.
+        cache.access_page("a.com", "A" * 64)
+        assert cache.get("a.com") == (None, False)
+        random.seed(0)
+        for i in range(1000):
+            url = "%d.com" % random.randint(0, 100)
+            cache.access_page(url, url * 2)
+            assert cache.get(url) == (url * 2, True)
+        pages = cache.get_pages()
+        assert len(pages) == len(set(pages)) == 32
+        for url in pages:
+            assert cache.get(url) == (url * 2, True)
+        assert cache.stats().page_count == 32
+
+        # Another SharedCache attached by name sees the same pages.
+        other = SharedCache(cache.name, cache.locks)
+        assert other.get(pages[0]) == (pages[0] * 2, True)
+        other.access_page("b.com", "BBB")
+        assert cache.get("b.com") == ("BBB", True)
+        other.close()
+
+    # Many processes read and write the cache at once.
+    with SharedCache(shards=4, slots=64, slot_size=1024) as cache:
+        random.seed(0)
+        traces = [["%d.com" % random.randint(0, 500) for i in range(2000)]
+                  for j in range(8)]
+        with Pool(8, init_worker, (cache.name, cache.locks)) as pool:
+            pool.map(crawl, traces)
+        for url in cache.get_pages():
+            assert cache.get(url) == (fetch(url), True)
+    print("Shared cache tests passed!")
+
+
+# Crawl a Zipf trace with |workers| processes, first with a private Cache
+# in each process, and then with one SharedCache, and print the fetches.
+def sharing_benchmark(workers=16, length=200000, urls=100000, n=16384):
+    random.seed(0)
+    weights = [1 / (i + 1) for i in range(urls)]
+    trace = ["%d.com" % i for i in random.choices(range(urls), weights, k=length)]
+    chunks = [trace[i::workers] for i in range(workers)]
+
+    begin = time.time()
+    with Pool(workers) as pool:
+        fetches = sum(pool.map(crawl_private, [(chunk, n) for chunk in chunks]))
+    end = time.time()
+    print("private caches: %d fetches (%.3f miss ratio) %.2f s" %
+          (fetches, fetches / length, end - begin))
+
+    # The same total memory: each private cache has n pages.
+    with SharedCache(shards=16, slots=n * workers // 16, slot_size=1024) as cache:
+        begin = time.time()
+        with Pool(workers, init_worker, (cache.name, cache.locks)) as pool:
+            fetches = sum(pool.map(crawl, chunks))
+        end = time.time()
+        print("shared cache:   %d fetches (%.3f miss ratio) %.2f s" %
+              (fetches, fetches / length, end - begin))
+    print("Sharing benchmark passed!")
+
+
+if __name__ == "__main__":
+    shared_cache_test()
+    sharing_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 16)
@@ -1,11 +1,23 @@
 #! /usr/bin/python3
 # Run this program with python3 (not python2)
 
+
+# The error of an invalid expression. The message says what is wrong.
+class CalculatorError(Exception):
+    pass
+
+
+# Return True if |character| is one of '0' to '9'. str.isdigit() is also
+# True for the other digits of Unicode like '²', which int() can not read.
+def is_digit(character):
+    return '0' <= character <= '9'
+
+
 def read_number(line, index):
     number = 0
     flag = 0
     keta = 1
-    while index < len(line) and (line[index].isdigit() or line[index] == '.'):
+    while index < len(line) and (is_digit(line[index]) or line[index] == '.'):
         if line[index] == '.':
             flag = 1
         else:
@@ -13,7 +25,19 @@ def read_number(line, index):
             if flag == 1:
                 keta *= 0.1
         index += 1
-    token = {'type': 'NUMBER', 'number': float(number * keta)}
+    try:
+        token = {'type': 'NUMBER', 'number': float(number * keta)}
+    except OverflowError:
+        raise CalculatorError('Number too large')
+    return token, index
+
+
+# A name of a variable: a letter or '_', followed by letters, digits and '_'.
+def read_name(line, index):
+    begin = index
+    while index < len(line) and (line[index].isalnum() or line[index] == '_'):
+        index += 1
+    token = {'type': 'NAME', 'name': line[begin:index]}
     return token, index
 
 
@@ -51,8 +75,10 @@ def tokenize(line):
     tokens = []
     index = 0
     while index < len(line):
-        if line[index].isdigit():
+        if is_digit(line[index]):
             (token, index) = read_number(line, index)
+        elif line[index].isalpha() or line[index] == '_':
+            (token, index) = read_name(line, index)
         elif line[index] == '+':
             (token, index) = read_plus(line, index)
         elif line[index] == '-':
@@ -66,121 +92,161 @@ def tokenize(line):
         elif line[index] == ')':
             (token, index) = read_right(line, index)
         else:
-            print('Invalid character found: ' + line[index])
-            exit(1)
+            raise CalculatorError('Invalid character found: ' + line[index])
         tokens.append(token)
     return tokens
 
 
 # <term>   ::= <factor> [ ('*'|'/') <factor> ]*
-def evaluate_term(tokens, index):
-    (number, index) = evaluate_factor(tokens, index)
+def evaluate_term(tokens, index, variables):
+    (number, index) = evaluate_factor(tokens, index, variables)
     result = number
     while index < len(tokens) and (tokens[index]['type'] == 'MULTIPLY' or tokens[index]['type'] == 'DIVIDE'):
         if tokens[index]['type'] == 'MULTIPLY':
-            (number, index) = evaluate_factor(tokens, index + 1)
+            (number, index) = evaluate_factor(tokens, index + 1, variables)
             result *= number
         else:
-            (number, index) = evaluate_factor(tokens, index + 1)
+            (number, index) = evaluate_factor(tokens, index + 1, variables)
             if number == 0:
-                print('Error: Division by 0')
-                exit(1)
+                raise CalculatorError('Division by 0')
             result /= number
     return (result, index)
 
 
 # <expression> ::= <term> [ ('+'|'-') <term> ]*
-def evaluate_expression(tokens, index):
-    (number, index) = evaluate_term(tokens, index)
+def evaluate_expression(tokens, index, variables):
+    (number, index) = evaluate_term(tokens, index, variables)
     result = number
     while index < len(tokens) and (tokens[index]['type'] == 'PLUS' or tokens[index]['type'] == 'MINUS'):
         if tokens[index]['type'] == 'PLUS':
-            (number, index) = evaluate_term(tokens, index + 1)
+            (number, index) = evaluate_term(tokens, index + 1, variables)
             result += number
         else:
-            (number, index) = evaluate_term(tokens, index + 1)
+            (number, index) = evaluate_term(tokens, index + 1, variables)
             result -= number
     return (result, index)
 
 
-# <factor> ::= <number> | '(' <expression> ')'
-def evaluate_factor(tokens, index):
-    if tokens[index]['type'] == 'NUMBER':
+# <factor> ::= <number> | <name> | '(' <expression> ')'
+def evaluate_factor(tokens, index, variables):
+    if index < len(tokens) and tokens[index]['type'] == 'NUMBER':
         return (tokens[index]['number'], index + 1)
-    if tokens[index]['type'] == 'LEFT':
-        (number, index) = evaluate_expression(tokens, index + 1)
-        if tokens[index]['type'] == 'RIGHT':
+    if index < len(tokens) and tokens[index]['type'] == 'NAME':
+        return (lookup(variables, tokens[index]['name']), index + 1)
+    if index < len(tokens) and tokens[index]['type'] == 'LEFT':
+        (number, index) = evaluate_expression(tokens, index + 1, variables)
+        if index < len(tokens) and tokens[index]['type'] == 'RIGHT':
             return (number, index + 1)
-        print('Parse error')
-        exit(1)
-    print('Parse error')
-    exit(1)
+    raise CalculatorError('Parse error')
+
 
+# Return the value of the variable |name| in |variables|.
+def lookup(variables, name):
+    if variables is None or name not in variables:
+        raise CalculatorError('Undefined variable: ' + name)
+    return variables[name]
 
-def evaluate(tokens):
-    (number, index) = evaluate_expression(tokens, 0)
-    assert(index == len(tokens))
+
+# |variables|: A dict from the name of a variable to its value.
+def evaluate(tokens, variables=None):
+    try:
+        (number, index) = evaluate_expression(tokens, 0, variables)
+    except RecursionError:
+        raise CalculatorError('Too deeply nested')
+    if index != len(tokens):
+        raise CalculatorError('Parse error')
     return number
 
 
-def test(line):
+def test(line, variables=None):
     tokens = tokenize(line)
-    actual_answer = evaluate(tokens)
-    expected_answer = eval(line)
+    actual_answer = evaluate(tokens, variables)
+    expected_answer = eval(line, {}, variables)
     if abs(actual_answer - expected_answer) < 1e-8:
         print("PASS! (%s = %f)" % (line, expected_answer))
     else:
         print("FAIL! (%s should be %f but was %f)" % (line, expected_answer, actual_answer))
 
 
-# Add more tests to this function :)
+# Add more tests to this list :)
+TEST_LINES = [
+    "1",
+    "11",
+    "2+3",
+    "2-3",
+    "2*3",
+    "2/3",
+    "2+3+4",
+    "2-3-4",
+    "2*3+4",
+    "2+3*4",
+    "2/3+4",
+    "2+3/4",
+    "2*3-4*5-6/7+8/9",
+    "11.1",
+    "1.1+2.2",
+    "1.1-2.2",
+    "1.1*2.2",
+    "1.1/2.2",
+    "1.1*2.2-3.3*4.4-5.5/6.6+7.7/8.8",
+    "(1)",
+    "(1+2)",
+    "((1))",
+    "((1.1))",
+    "(1+2)*3",
+    "(1+2)/3",
+    "1*(2+3)",
+    "1/(2+3)",
+    "(1+2)*(3+4)",
+    "(1+2)/(3+4)",
+    "1-(2-3)",
+    "1-(2-(3-4))",
+    "1-(2-(3-(4-5)))",
+    "1-(2-(3-(4-5)-6))",
+    "1-(2-(3-(4-5)-6))",
+    "1-(2-(3-(4-5)-6)-7)",
+    "1-(2-(3-(4-5)-6)-7)-8",
+    "(1+2)*3-4/(5-(6-7*8+9/(10-11)*12))",
+    "(1.1+2.2)*3.3-4.4/(5.5-(6.5-7.7*8.8+9.9/(10.0-11.1)*12.2))",
+]
+
+
+TEST_VARIABLES = {'a': 1.5, 'b': 2.0, 'c': 3.0, 'd': 7.0, 'e': 2.5, 'x_1': 4.0}
+TEST_VARIABLE_LINES = [
+    "a",
+    "a+b",
+    "(a+b)*c-4/(d-e)",
+    "x_1*x_1-a/(b-c)",
+    "1-(a-(b-(c-d)-e))",
+]
+
+
 def run_test():
     print("==== Test started! ====")
-    test("1")
-    test("11")
-    test("2+3")
-    test("2-3")
-    test("2*3")
-    test("2/3")
-    test("2+3+4")
-    test("2-3-4")
-    test("2*3+4")
-    test("2+3*4")
-    test("2/3+4")
-    test("2+3/4")
-    test("2*3-4*5-6/7+8/9")
-    test("11.1")
-    test("1.1+2.2")
-    test("1.1-2.2")
-    test("1.1*2.2")
-    test("1.1/2.2")
-    test("1.1*2.2-3.3*4.4-5.5/6.6+7.7/8.8")
-    test("(1)")
-    test("(1+2)")
-    test("((1))")
-    test("((1.1))")
-    test("(1+2)*3")
-    test("(1+2)/3")
-    test("1*(2+3)")
-    test("1/(2+3)")
-    test("(1+2)*(3+4)")
-    test("(1+2)/(3+4)")
-    test("1-(2-3)")
-    test("1-(2-(3-4))")
-    test("1-(2-(3-(4-5)))")
-    test("1-(2-(3-(4-5)-6))")
-    test("1-(2-(3-(4-5)-6))")
-    test("1-(2-(3-(4-5)-6)-7)")
-    test("1-(2-(3-(4-5)-6)-7)-8")
-    test("(1+2)*3-4/(5-(6-7*8+9/(10-11)*12))")
-    test("(1.1+2.2)*3.3-4.4/(5.5-(6.5-7.7*8.8+9.9/(10.0-11.1)*12.2))")
+    for line in TEST_LINES:
+        test(line)
+    for line in TEST_VARIABLE_LINES:
+        test(line, TEST_VARIABLES)
+    for line in ["1+", "(1+2", "1+2)", "1/0", "1/(2-2)", "1a", "", "x+1",
+                 "2\u00b2"]:
+        try:
+            evaluate(tokenize(line))
+            print("FAIL! (%s should be an error)" % line)
+        except CalculatorError as error:
+            print("PASS! (%s: %s)" % (line, error))
     print("==== Test finished! ====\n")
 
-run_test()
 
-while True:
-    print('> ', end="")
-    line = input()
-    tokens = tokenize(line)
-    answer = evaluate(tokens)
-    print("answer = %f\n" % answer)
+if __name__ == "__main__":
+    run_test()
+
+    while True:
+        print('> ', end="")
+        line = input()
+        try:
+            tokens = tokenize(line)
+            answer = evaluate(tokens)
+        except CalculatorError as error:
+            print("Error: %s\n" % error)
+            continue
+        print("answer = %f\n" % answer)
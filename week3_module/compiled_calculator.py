@@ -0,0 +1,503 @@
+#! /usr/bin/python3
+# Run this program with python3 (not python2)
+
+import argparse, itertools, os, random, sys, tempfile, time, traceback
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from calculator_ll import (CalculatorError, TEST_LINES, TEST_VARIABLE_LINES,
+                           TEST_VARIABLES, evaluate, lookup, tokenize)
+
+# How to use:
+#
+# $ python3 compiled_calculator.py
+#     Read an expression from the prompt and print the answer.
+# $ python3 compiled_calculator.py --batch input_file [--output output_file] [--workers N]
+#     Evaluate each line of |input_file| and write the answers, one line for
+#     each input line, to |output_file| (or the standard output). An invalid
+#     line is written as "ERROR: <message>" and the rest are still evaluated.
+# $ python3 compiled_calculator.py --benchmark
+
+# A calculator that compiles an expression once and runs it many times.
+#
+# calculator_ll.py tokenizes a line and evaluates it with recursive calls
+# every time. Here the same grammar is compiled into postfix bytecode, a
+# flat list like [PUSH, 1.0, LOAD, 'a', ADD], and a stack machine runs it
+# without parsing. The constant subexpressions are folded while compiling,
+# and ExpressionCache keeps the compiled lines that are used again.
+
+# The opcodes. PUSH is followed by the number to push, and LOAD by the name
+# of the variable to push. The others pop two numbers a and b (b is the top)
+# and push the result of a <op> b.
+PUSH = 0
+ADD = 1
+SUBTRACT = 2
+MULTIPLY = 3
+DIVIDE = 4
+LOAD = 5
+
+OPCODES = {'PLUS': ADD, 'MINUS': SUBTRACT, 'MULTIPLY': MULTIPLY,
+           'DIVIDE': DIVIDE}
+OPCODE_NAMES = ['PUSH', 'ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'LOAD']
+
+
+# Constant folding:
+# Each compile_* function returns (index, constant). |constant| is the value
+# of the subexpression if it has no variable, or None. Such a subexpression
+# was compiled to just [PUSH, constant], so when both operands of an
+# operator are constants, their two PUSHes are replaced with one PUSH of the
+# result. The operators are applied in the same order as run() would, so
+# the result is the same float. A division by a constant 0 is not folded,
+# and the error is raised by run() as before.
+
+
+# Emit |opcode| for the operands |left| and |right| (constants or None).
+# Return value: The constant of the result, or None.
+def emit_operator(code, opcode, left, right):
+    if left is None or right is None or (opcode == DIVIDE and right == 0):
+        code.append(opcode)
+        return None
+    del code[-4:]
+    if opcode == ADD:
+        constant = left + right
+    elif opcode == SUBTRACT:
+        constant = left - right
+    elif opcode == MULTIPLY:
+        constant = left * right
+    else:
+        constant = left / right
+    code.append(PUSH)
+    code.append(constant)
+    return constant
+
+
+# <term>   ::= <factor> [ ('*'|'/') <factor> ]*
+def compile_term(tokens, index, code):
+    (index, constant) = compile_factor(tokens, index, code)
+    while index < len(tokens) and (tokens[index]['type'] == 'MULTIPLY' or tokens[index]['type'] == 'DIVIDE'):
+        opcode = OPCODES[tokens[index]['type']]
+        (index, right) = compile_factor(tokens, index + 1, code)
+        constant = emit_operator(code, opcode, constant, right)
+    return (index, constant)
+
+
+# <expression> ::= <term> [ ('+'|'-') <term> ]*
+def compile_expression(tokens, index, code):
+    (index, constant) = compile_term(tokens, index, code)
+    while index < len(tokens) and (tokens[index]['type'] == 'PLUS' or tokens[index]['type'] == 'MINUS'):
+        opcode = OPCODES[tokens[index]['type']]
+        (index, right) = compile_term(tokens, index + 1, code)
+        constant = emit_operator(code, opcode, constant, right)
+    return (index, constant)
+
+
+# <factor> ::= <number> | <name> | '(' <expression> ')'
+def compile_factor(tokens, index, code):
+    if index < len(tokens) and tokens[index]['type'] == 'NUMBER':
+        code.append(PUSH)
+        code.append(tokens[index]['number'])
+        return (index + 1, tokens[index]['number'])
+    if index < len(tokens) and tokens[index]['type'] == 'NAME':
+        code.append(LOAD)
+        code.append(tokens[index]['name'])
+        return (index + 1, None)
+    if index < len(tokens) and tokens[index]['type'] == 'LEFT':
+        (index, constant) = compile_expression(tokens, index + 1, code)
+        if index < len(tokens) and tokens[index]['type'] == 'RIGHT':
+            return (index + 1, constant)
+    raise CalculatorError('Parse error')
+
+
+# Compile |line| into the bytecode.
+def compile_line(line):
+    tokens = tokenize(line)
+    code = []
+    try:
+        (index, constant) = compile_expression(tokens, 0, code)
+    except RecursionError:
+        raise CalculatorError('Too deeply nested')
+    if index != len(tokens):
+        raise CalculatorError('Parse error')
+    return code
+
+
+# A compiled line in ExpressionCache.
+#
+# |code|: The bytecode, or None if the line has an error.
+# |constant|: The answer if the line has no variable, or None.
+# |error|: The message of the CalculatorError of compiling the line, or
+#          None. A new error is raised for each hit, so that the traceback
+#          of a cached error does not grow.
+# |compile_time|: The seconds it takes to compile the line.
+# |run_time|: The seconds it takes to run the bytecode of a constant line,
+#             or 0.
+class CompiledLine:
+    __slots__ = ('code', 'constant', 'error', 'compile_time', 'run_time')
+
+    def __init__(self, code, constant, error, compile_time):
+        self.code = code
+        self.constant = constant
+        self.error = error
+        self.compile_time = compile_time
+        self.run_time = 0.0
+
+
+# An LRU cache of the compiled lines, keyed on the line without the
+# surrounding whitespace.
+#
+# |size|: The maximum number of the lines.
+#
+# A hit skips tokenizing and compiling, and for a constant line also
+# running. |self.saved_time| adds up the time of those steps, once for every
+# hit. The first compile of a line is slower than the later ones would be,
+# so the times are the best of TIMING_REPEAT measurements taken on a miss.
+# A line that can not be compiled is cached too, and its error is raised
+# again.
+class ExpressionCache:
+    TIMING_REPEAT = 3
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.lines = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+
+    # Return the CompiledLine of |line|.
+    def compile(self, line):
+        key = line.strip()
+        compiled = self.lines.get(key)
+        if compiled is not None:
+            self.lines.move_to_end(key)
+            self.hits += 1
+            self.saved_time += compiled.compile_time
+            if compiled.constant is not None:
+                self.saved_time += compiled.run_time
+            return compiled
+        self.misses += 1
+        try:
+            code = compile_line(key)
+            compiled = CompiledLine(code, None, None, 0.0)
+            if len(code) == 2 and code[0] == PUSH:
+                compiled.constant = code[1]
+                compiled.run_time = self.best_time(run, code)
+        except CalculatorError as error:
+            compiled = CompiledLine(None, None, str(error), 0.0)
+        compiled.compile_time = self.best_time(compile_line, key)
+        self.lines[key] = compiled
+        if len(self.lines) > self.size:
+            self.lines.popitem(last=False)
+        return compiled
+
+    # Return the shortest of TIMING_REPEAT times of function(*args) in
+    # seconds. A CalculatorError is timed too.
+    def best_time(self, function, *args):
+        best = None
+        for i in range(self.TIMING_REPEAT):
+            begin = time.perf_counter()
+            try:
+                function(*args)
+            except CalculatorError:
+                pass
+            elapsed = time.perf_counter() - begin
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+    # Evaluate |line| with |variables| and return the answer.
+    def evaluate(self, line, variables=None):
+        compiled = self.compile(line)
+        if compiled.error is not None:
+            raise CalculatorError(compiled.error)
+        if compiled.constant is not None:
+            return compiled.constant
+        return run(compiled.code, variables)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return ("lines %d hits %d misses %d hit rate %.3f saved %.3f s" %
+                (len(self.lines), self.hits, self.misses, self.hit_rate(),
+                 self.saved_time))
+
+
+# Run the bytecode |code| and return the answer.
+# |variables|: A dict from the name of a variable to its value.
+def run(code, variables=None):
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    index = 0
+    end = len(code)
+    while index < end:
+        opcode = code[index]
+        if opcode == PUSH:
+            push(code[index + 1])
+            index += 2
+            continue
+        if opcode == LOAD:
+            push(lookup(variables, code[index + 1]))
+            index += 2
+            continue
+        b = pop()
+        if opcode == ADD:
+            stack[-1] += b
+        elif opcode == SUBTRACT:
+            stack[-1] -= b
+        elif opcode == MULTIPLY:
+            stack[-1] *= b
+        else:
+            if b == 0:
+                raise CalculatorError('Division by 0')
+            stack[-1] /= b
+        index += 1
+    return stack[0]
+
+
+# Return the bytecode as a readable string, e.g. "PUSH 1.0 PUSH 2.0 ADD".
+def disassemble(code):
+    words = []
+    index = 0
+    while index < len(code):
+        words.append(OPCODE_NAMES[code[index]])
+        if code[index] == PUSH or code[index] == LOAD:
+            words.append(str(code[index + 1]))
+            index += 1
+        index += 1
+    return ' '.join(words)
+
+
+def test(line, variables=None):
+    actual_answer = run(compile_line(line), variables)
+    expected_answer = eval(line, {}, variables)
+    if abs(actual_answer - expected_answer) < 1e-8:
+        print("PASS! (%s = %f)" % (line, expected_answer))
+    else:
+        print("FAIL! (%s should be %f but was %f)" % (line, expected_answer, actual_answer))
+
+
+def run_test():
+    print("==== Test started! ====")
+    for line in TEST_LINES:
+        test(line)
+    for line in TEST_VARIABLE_LINES:
+        test(line, TEST_VARIABLES)
+    assert disassemble(compile_line("a*(b+1)")) == "LOAD a LOAD b PUSH 1.0 ADD MULTIPLY"
+    assert disassemble(compile_line("a+2*3")) == "LOAD a PUSH 6.0 ADD"
+    # Constant folding.
+    assert disassemble(compile_line("(1+2)*3")) == "PUSH 9.0"
+    assert disassemble(compile_line("a*((1+2)*3-4/(2-1))")) == "LOAD a PUSH 5.0 MULTIPLY"
+    assert disassemble(compile_line("a+1+2")) == "LOAD a PUSH 1.0 ADD PUSH 2.0 ADD"
+    assert disassemble(compile_line("2*(1/(3-3))")) == "PUSH 2.0 PUSH 1.0 PUSH 0.0 DIVIDE MULTIPLY"
+    expression_cache_test()
+    assert evaluate_lines(["1+2", "1/0", "(1", "2*3\n"])[0] == \
+        ["3.0", "ERROR: Division by 0", "ERROR: Parse error", "6.0"]
+    batch_test()
+    print("==== Test finished! ====\n")
+
+
+def expression_cache_test():
+    cache = ExpressionCache(2)
+    assert cache.evaluate("(1+2)*3") == 9.0
+    assert cache.evaluate(" (1+2)*3\n") == 9.0
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.evaluate("a*2", {'a': 3.0}) == 6.0
+    assert cache.evaluate("a*2", {'a': 4.0}) == 8.0
+    # A cached error is raised as a new one, and its traceback does not grow.
+    tracebacks = []
+    for line in ["1/", "1/"]:
+        try:
+            cache.evaluate(line)
+            assert False
+        except CalculatorError as error:
+            assert str(error) == 'Parse error'
+            tracebacks.append(len(traceback.extract_tb(error.__traceback__)))
+    assert tracebacks[1] <= tracebacks[0]
+    # The least recently used line is dropped.
+    assert list(cache.lines) == ["a*2", "1/"]
+    assert (cache.hits, cache.misses) == (3, 3)
+    # An error of running is not cached.
+    try:
+        cache.evaluate("a/0", {'a': 1.0})
+        assert False
+    except CalculatorError as error:
+        assert str(error) == 'Division by 0'
+    assert cache.saved_time > 0
+
+
+# The number of the lines sent to a worker at once.
+BATCH_SIZE = 4096
+
+
+# The cache of the lines of evaluate_lines(). Each worker process has its
+# own.
+line_cache = ExpressionCache()
+
+
+# Evaluate each of |lines| and return the output lines (without '\n'), and
+# the hits, the misses and the saved time of the cache for them.
+def evaluate_lines(lines):
+    (hits, misses, saved_time) = (line_cache.hits, line_cache.misses,
+                                  line_cache.saved_time)
+    results = []
+    for line in lines:
+        try:
+            results.append(repr(line_cache.evaluate(line)))
+        except CalculatorError as error:
+            results.append("ERROR: %s" % error)
+    return (results, line_cache.hits - hits, line_cache.misses - misses,
+            line_cache.saved_time - saved_time)
+
+
+# Read |input_file| in chunks of |size| lines.
+def read_chunks(input_file, size):
+    with open(input_file) as f:
+        while True:
+            lines = list(itertools.islice(f, size))
+            if not lines:
+                return
+            yield lines
+
+
+# Evaluate each line of |input_file| and write the results to |output|,
+# a file object, in the order of the input. With |workers| > 1, the chunks
+# of the lines are evaluated in parallel, and the results are streamed as
+# soon as the earliest chunk is done.
+# Return value: The number of the lines, the number of the errors, and the
+#               hits, the misses and the saved time of the caches of all
+#               the workers.
+def evaluate_file(input_file, output, workers=1):
+    line_count = 0
+    error_count = 0
+    (hits, misses, saved_time) = (0, 0, 0.0)
+    chunks = read_chunks(input_file, BATCH_SIZE)
+    if workers > 1:
+        pool = Pool(workers)
+        results = pool.imap(evaluate_lines, chunks)
+    else:
+        pool = None
+        results = map(evaluate_lines, chunks)
+    try:
+        for (lines, chunk_hits, chunk_misses, chunk_saved_time) in results:
+            for line in lines:
+                output.write(line + '\n')
+                if line.startswith("ERROR: "):
+                    error_count += 1
+            line_count += len(lines)
+            hits += chunk_hits
+            misses += chunk_misses
+            saved_time += chunk_saved_time
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return (line_count, error_count, hits, misses, saved_time)
+
+
+def batch_test():
+    # A too large number, too deep parentheses and a non-ASCII digit are
+    # errors of their lines, and the other lines are still evaluated.
+    lines = TEST_LINES + ["1+", "1/0", "1a", "9" * 400,
+                          "(" * 2000 + "1" + ")" * 2000, "2\u00b2"]
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = os.path.join(directory, "input.txt")
+        with open(input_file, 'w') as f:
+            for i in range(1000):
+                f.write(lines[i % len(lines)] + '\n')
+        outputs = []
+        for workers in (1, 2):
+            output_file = os.path.join(directory, "output%d.txt" % workers)
+            with open(output_file, 'w') as f:
+                assert evaluate_file(input_file, f, workers)[0] == 1000
+            with open(output_file) as f:
+                outputs.append(f.read())
+        assert outputs[0] == outputs[1]
+        results = outputs[0].splitlines()
+        for i in range(1000):
+            line = lines[i % len(lines)]
+            if i % len(lines) < len(TEST_LINES):
+                assert abs(float(results[i]) - eval(line)) < 1e-8
+            else:
+                assert results[i].startswith("ERROR: ")
+
+
+# Evaluate each test line |repeat| times, by parsing every time
+# (calculator_ll.py) and by running the bytecode compiled once.
+def benchmark(repeat=10000):
+    begin = time.time()
+    for line in TEST_LINES:
+        for i in range(repeat):
+            evaluate(tokenize(line))
+    parsed = time.time() - begin
+
+    begin = time.time()
+    for line in TEST_LINES:
+        code = compile_line(line)
+        for i in range(repeat):
+            run(code)
+    compiled = time.time() - begin
+    print("parse every time: %.3f s, compile once: %.3f s (%.1fx)" %
+          (parsed, compiled, parsed / compiled))
+
+    # Dashboard traffic: the same lines again and again, in a Zipf
+    # distribution.
+    random.seed(0)
+    lines = TEST_LINES + TEST_VARIABLE_LINES
+    weights = [1 / (i + 1) for i in range(len(lines))]
+    trace = random.choices(lines, weights, k=repeat * 10)
+    begin = time.time()
+    for line in trace:
+        run(compile_line(line), TEST_VARIABLES)
+    uncached = time.time() - begin
+    cache = ExpressionCache()
+    begin = time.time()
+    for line in trace:
+        cache.evaluate(line, TEST_VARIABLES)
+    cached = time.time() - begin
+    print("dashboard trace: compile every time: %.3f s, cached: %.3f s (%.1fx)" %
+          (uncached, cached, uncached / cached))
+    print("cache: %s" % cache)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', metavar='input_file')
+    parser.add_argument('--output', metavar='output_file')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        output = sys.stdout if args.output is None else open(args.output, 'w')
+        try:
+            (line_count, error_count, hits, misses, saved_time) = \
+                evaluate_file(args.batch, output, args.workers)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        print("%d lines, %d errors, cache hit rate %.3f, saved %.3f s" %
+              (line_count, error_count, hits / max(hits + misses, 1),
+               saved_time), file=sys.stderr)
+        return
+
+    run_test()
+    if args.benchmark:
+        benchmark()
+        return
+
+    cache = ExpressionCache()
+    while True:
+        print('> ', end="")
+        line = input()
+        try:
+            answer = cache.evaluate(line)
+        except CalculatorError as error:
+            print("Error: %s\n" % error)
+            continue
+        print("answer = %f\n" % answer)
+
+
+if __name__ == "__main__":
+    main()
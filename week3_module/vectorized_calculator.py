@@ -0,0 +1,163 @@
+#! /usr/bin/python3
+# Run this program with python3 (not python2)
+
+import sys, time
+
+import numpy as np
+
+from compiled_calculator import (ADD, DIVIDE, LOAD, MULTIPLY, PUSH, SUBTRACT,
+                                 compile_line, run)
+from calculator_ll import CalculatorError, TEST_VARIABLE_LINES, lookup
+
+# How to use:
+#
+# $ python3 vectorized_calculator.py [rows]
+#     Run the tests and the benchmark over |rows| rows.
+#
+# Apply a formula with variables like "(a+b)*c-4/(d-e)" to whole NumPy
+# columns. The formula is compiled once by compiled_calculator.py, and each
+# operator of the bytecode runs as one vectorized operation over all the
+# rows, instead of running the calculator once per row.
+
+
+# Run the bytecode |code| over the columns in |variables|.
+#
+# |variables|: A dict from the name of a variable to a NumPy array (or a
+#              number). The arrays are broadcast together.
+# Return value: An array of the answers, or a float if the formula has no
+#               array. A row that divides by 0 is NaN, since the other rows
+#               still have answers.
+#
+# An intermediate result is owned by the stack machine, so the next operator
+# writes into it instead of allocating a new array. The arrays of
+# |variables| are never written.
+def run_vectorized(code, variables):
+    stack = []
+    # owned[i] is True if stack[i] is an intermediate array.
+    owned = []
+    index = 0
+    end = len(code)
+    while index < end:
+        opcode = code[index]
+        if opcode == PUSH or opcode == LOAD:
+            if opcode == PUSH:
+                stack.append(code[index + 1])
+            else:
+                stack.append(np.asarray(lookup(variables, code[index + 1]),
+                                        dtype=np.float64))
+            owned.append(False)
+            index += 2
+            continue
+        b = stack.pop()
+        b_owned = owned.pop()
+        a = stack[-1]
+        shape = np.broadcast_shapes(np.shape(a), np.shape(b))
+        if owned[-1] and np.shape(a) == shape:
+            out = a
+        elif b_owned and np.shape(b) == shape:
+            out = b
+        else:
+            out = None
+        if opcode == ADD:
+            result = np.add(a, b, out=out)
+        elif opcode == SUBTRACT:
+            result = np.subtract(a, b, out=out)
+        elif opcode == MULTIPLY:
+            result = np.multiply(a, b, out=out)
+        elif opcode == DIVIDE:
+            # x / 0 is inf (or NaN for 0 / 0) in NumPy. Make them all NaN.
+            # The zeros are found first, because |out| may be |b|.
+            zero = np.equal(b, 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result = np.divide(a, b, out=out)
+            if np.ndim(result) == 0:
+                result = np.nan if zero else result
+            elif np.any(zero):
+                result[np.broadcast_to(zero, np.shape(result))] = np.nan
+        else:
+            raise ValueError("Unknown opcode: %r" % opcode)
+        stack[-1] = result
+        owned[-1] = np.ndim(result) > 0
+        index += 1
+    if np.ndim(stack[0]) == 0:
+        return float(stack[0])
+    if not owned[0]:
+        # The formula is just a variable. Do not return the input array.
+        return stack[0].copy()
+    return stack[0]
+
+
+# Compile |line| once and apply it to the columns in |variables|.
+def evaluate_columns(line, variables):
+    return run_vectorized(compile_line(line), variables)
+
+
+# Return |rows| rows of random columns for the variables of the tests.
+def random_columns(rows, seed=0):
+    generator = np.random.default_rng(seed)
+    columns = {}
+    for name in ['a', 'b', 'c', 'd', 'e', 'x_1']:
+        columns[name] = generator.uniform(-10, 10, rows)
+    return columns
+
+
+def run_test():
+    print("==== Test started! ====")
+    columns = random_columns(1000)
+    # Some rows divide by 0.
+    columns['d'][:10] = columns['e'][:10]
+    columns['c'][10:20] = columns['b'][10:20]
+    for line in TEST_VARIABLE_LINES + ["1+2*3", "a/0", "0/(a-a)", "2/a*(b-b)"]:
+        code = compile_line(line)
+        answers = run_vectorized(code, columns)
+        expected = np.empty(1000)
+        for i in range(1000):
+            try:
+                expected[i] = run(code, {name: float(column[i])
+                                         for name, column in columns.items()})
+            except CalculatorError:
+                expected[i] = np.nan
+        if np.allclose(answers, expected, equal_nan=True):
+            print("PASS! (%s)" % line)
+        else:
+            print("FAIL! (%s)" % line)
+    # The input columns are not written.
+    a = columns['a'].copy()
+    assert np.array_equal(evaluate_columns("a*2+a", columns), a * 3)
+    assert np.array_equal(columns['a'], a)
+    result = evaluate_columns("a", columns)
+    result[0] = 0
+    assert np.array_equal(columns['a'], a)
+    # A number and a column broadcast.
+    assert evaluate_columns("(a+1)*2", {'a': 1.5}) == 5.0
+    assert np.array_equal(evaluate_columns("a+b", {'a': np.arange(3), 'b': 1}),
+                          np.array([1.0, 2.0, 3.0]))
+    print("==== Test finished! ====\n")
+
+
+# Apply "(a+b)*c-4/(d-e)" to |rows| rows, by running the bytecode once per
+# row and by running it once over the columns.
+def benchmark(rows=1000000):
+    line = "(a+b)*c-4/(d-e)"
+    columns = random_columns(rows)
+    code = compile_line(line)
+
+    # One row at a time is slow, so time a part of the rows and scale it.
+    sample = min(rows, 100000)
+    begin = time.time()
+    for i in range(sample):
+        run(code, {'a': columns['a'][i], 'b': columns['b'][i],
+                   'c': columns['c'][i], 'd': columns['d'][i],
+                   'e': columns['e'][i]})
+    per_row = (time.time() - begin) / sample * rows
+
+    begin = time.time()
+    run_vectorized(code, columns)
+    vectorized = time.time() - begin
+    print("%d rows: per row %.3f s (estimated), vectorized %.3f s (%.0fx)" %
+          (rows, per_row, vectorized, per_row / vectorized))
+
+
+if __name__ == "__main__":
+    run_test()
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)